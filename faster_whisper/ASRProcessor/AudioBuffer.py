@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class AudioBuffer:
+    """Growable arena for streaming audio.
+
+    Samples are appended to a preallocated array and trimmed from the front by moving a start index,
+    so append is amortized O(1) and trimming is O(1). view() returns a contiguous zero-copy slice of
+    the live samples.
+    The arena is never compacted in place: when it runs out of room, the live samples are moved into a
+    newly allocated array. A view therefore stays valid (and unchanged) after later appends and trims.
+    """
+
+    def __init__(self, capacity=16000 * 8, dtype=np.float32, frame_shape=()):
+        """capacity: initial number of frames (samples) that fit without reallocation.
+        dtype: dtype of the stored frames.
+        frame_shape: shape of one frame, () for audio samples. E.g. (80,) stores mel feature frames.
+        """
+        self.dtype = np.dtype(dtype)
+        self.frame_shape = tuple(frame_shape)
+        self._data = np.empty((max(1, int(capacity)),) + self.frame_shape, dtype=self.dtype)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def view(self):
+        """Returns the live frames as a contiguous array, without copying."""
+        return self._data[self._start:self._end]
+
+    def append(self, data):
+        data = np.asarray(data)
+        n = len(data)
+        if n == 0:
+            return
+        if self._end + n > len(self._data):
+            self._reserve(n)
+        self._data[self._end:self._end + n] = data
+        self._end += n
+
+    def trim(self, n):
+        """drops n frames from the front"""
+        self._start += min(max(0, int(n)), len(self))
+
+    def keep_last(self, n):
+        """drops all but the last n frames"""
+        self.trim(len(self) - n)
+
+    def clear(self):
+        self._start = self._end
+
+    def _reserve(self, n):
+        live = len(self)
+        # at least double the room, so that the copying is amortized over the following appends
+        capacity = max(len(self._data), 2 * (live + n))
+        data = np.empty((capacity,) + self.frame_shape, dtype=self.dtype)
+        data[:live] = self._data[self._start:self._end]
+        self._data = data
+        self._start = 0
+        self._end = live
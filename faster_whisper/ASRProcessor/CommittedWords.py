@@ -0,0 +1,62 @@
+from collections import deque
+
+
+class CommittedWords:
+    """Bounded store of the committed words of a stream.
+
+    It keeps the committed words inside the audio buffer (the context), and a suffix of the words before the buffer
+    that is just long enough for the prompt. The older words are passed to the sink, if there is any, and forgotten,
+    so the memory and the prompt building time don't grow with the length of the stream.
+    """
+
+    def __init__(self, prompt_size=200, sink=None):
+        """prompt_size: number of characters of the prompt
+        sink: optional callable, it receives the list of (beg, end, "word") words that are dropped from the store
+        """
+        self.prompt_size = prompt_size
+        self.sink = sink
+        self.prompt_words = deque()
+        self.prompt_len = 0
+        self.context = deque()
+
+    def __len__(self):
+        return len(self.prompt_words) + len(self.context)
+
+    def __iter__(self):
+        yield from self.prompt_words
+        yield from self.context
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if 0 <= i < len(self.prompt_words):
+            return self.prompt_words[i]
+        return self.context[i - len(self.prompt_words)]
+
+    def extend(self, words):
+        self.context.extend(words)
+
+    def advance(self, offset):
+        """Moves the words that end before the audio buffer "offset" to the prompt. The last committed word is always
+        kept in the context.
+        """
+        while len(self.context) > 1 and self.context[0][1] <= offset:
+            w = self.context.popleft()
+            self.prompt_words.append(w)
+            self.prompt_len += len(w[2]) + 1
+        dropped = []
+        while self.prompt_words and self.prompt_len - len(self.prompt_words[0][2]) - 1 >= self.prompt_size:
+            w = self.prompt_words.popleft()
+            self.prompt_len -= len(w[2]) + 1
+            dropped.append(w)
+        if dropped and self.sink is not None:
+            self.sink(dropped)
+
+    def clear(self):
+        """drops all the words, they are passed to the sink"""
+        words = list(self)
+        self.prompt_words.clear()
+        self.context.clear()
+        self.prompt_len = 0
+        if words and self.sink is not None:
+            self.sink(words)
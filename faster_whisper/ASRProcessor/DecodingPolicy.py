@@ -0,0 +1,81 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DecodingPolicy:
+    """Latency-budgeted decoding options for streaming.
+
+    It tracks the real-time factor (RTF) of the processing: the compute time of an iteration divided by the duration
+    of the audio received for it, smoothed by an exponential moving average. When the RTF gets close to 1, the
+    processing falls behind, so the policy moves to the next, cheaper level of decoding options. When there is
+    headroom again, it moves back. A level is kept for at least `patience` iterations, so that it doesn't oscillate.
+    The policy is thread-safe: the ASR processors of a session that finalize utterances in the background share it.
+    """
+
+    # options passed to transcribe on top of the defaults, from the full quality to the cheapest
+    LEVELS = (
+        {},
+        {"beam_size": 2},
+        {"beam_size": 1, "temperature": 0.0},
+        {"beam_size": 1, "temperature": 0.0, "max_new_tokens": 128},
+    )
+
+    STATE = ("level", "rtf", "since_change")  # the attributes kept by snapshot()
+
+    def __init__(self, high=0.8, low=0.5, smoothing=0.3, patience=3, levels=LEVELS):
+        """high: RTF above which the decoding is degraded by one level
+        low: RTF below which the decoding is restored by one level
+        smoothing: weight of the last iteration in the moving average of RTF
+        patience: minimal number of iterations between two level changes
+        levels: sequence of transcribe options, from the best to the cheapest
+        """
+        self.high = high
+        self.low = low
+        self.smoothing = smoothing
+        self.patience = patience
+        self.levels = levels
+        self.mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.mutex:
+            self.level = 0
+            self.rtf = None
+            self.since_change = 0
+
+    def snapshot(self):
+        """Returns a copy of the state, to be continued by restore()."""
+        with self.mutex:
+            return {k: getattr(self, k) for k in self.STATE}
+
+    def restore(self, state):
+        """Continues from a state returned by snapshot()."""
+        with self.mutex:
+            for k in self.STATE:
+                setattr(self, k, state[k])
+
+    def options(self):
+        """Returns the transcribe options of the current level."""
+        with self.mutex:
+            return self.levels[self.level]
+
+    def update(self, compute_time, audio_time):
+        """Reports an iteration that took compute_time seconds, for audio_time seconds of newly received audio."""
+        if audio_time <= 0:
+            return
+        rtf = compute_time / audio_time
+        with self.mutex:
+            self.rtf = rtf if self.rtf is None else self.smoothing * rtf + (1 - self.smoothing) * self.rtf
+            self.since_change += 1
+            if self.since_change < self.patience:
+                return
+            if self.rtf > self.high and self.level < len(self.levels) - 1:
+                self.level += 1
+            elif self.rtf < self.low and self.level > 0:
+                self.level -= 1
+            else:
+                return
+            self.since_change = 0
+            logger.debug(f"RTF {self.rtf:.2f}, decoding level {self.level}: {self.levels[self.level]}")
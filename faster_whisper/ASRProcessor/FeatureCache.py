@@ -0,0 +1,71 @@
+import numpy as np
+from .AudioBuffer import AudioBuffer
+
+
+class FeatureCache:
+    """Rolling log-Mel spectrogram of the streaming audio buffer.
+
+    It returns the same features as feature_extractor(audio), but keeps the (unnormalized) log-Mel frames
+    that cannot change anymore, and computes only the frames of newly appended samples on the next call.
+    A frame is final once all the n_fft samples under its window are in the buffer. The first frames are
+    computed from reflect padding of the buffer start, so they are recomputed after trimming.
+    """
+
+    def __init__(self, feature_extractor, padding=160):
+        """feature_extractor: FeatureExtractor of the model
+        padding: the same padding as in FeatureExtractor.__call__
+        """
+        self.feature_extractor = feature_extractor
+        self.hop_length = feature_extractor.hop_length
+        self.padding = padding
+        self.half_window = feature_extractor.n_fft // 2
+        # frames reaching into the reflect padding of the buffer start
+        self.n_head = -(-self.half_window // self.hop_length)
+        n_mels = feature_extractor.mel_filters.shape[0]
+        self.frames = AudioBuffer(capacity=feature_extractor.nb_max_frames, frame_shape=(n_mels,))
+        self.reset()
+
+    def reset(self):
+        self.frames.clear()
+        self.head_dirty = False
+
+    def trim(self, n):
+        """Drops the frames of the first n samples of the audio buffer.
+        The cache survives only cuts aligned to hop_length, otherwise it is reset.
+        """
+        if n % self.hop_length != 0:
+            self.reset()
+            return
+        self.frames.trim(n // self.hop_length)
+        self.head_dirty = True
+
+    def __call__(self, audio):
+        """audio: the whole audio buffer, it must be the previous one extended and/or trimmed by self.trim
+        Returns: normalized log-Mel features, the same as feature_extractor(audio)
+        """
+        n_total = len(audio) // self.hop_length + 1
+        n_final = max(0, (len(audio) - self.half_window) // self.hop_length + 1)
+        a = len(self.frames)
+
+        if a > n_final:
+            self.reset()
+            a = 0
+        if a < self.n_head:
+            log_spec = self.feature_extractor.log_mel_frames(np.pad(audio, (0, self.padding)))[:, :n_total]
+            self.reset()
+            self.frames.append(log_spec[:, :n_final].T)
+            return self.feature_extractor.normalize(log_spec)
+
+        if self.head_dirty:
+            head = audio[:(self.n_head - 1) * self.hop_length + self.half_window]
+            head = np.pad(head, (self.half_window, 0), mode="reflect")
+            self.frames.view()[:self.n_head] = self.feature_extractor.log_mel_frames(head, center=False).T
+            self.head_dirty = False
+
+        tail = np.pad(audio[a * self.hop_length - self.half_window:], (0, self.padding))
+        tail = np.pad(tail, (0, self.half_window), mode="reflect")
+        log_spec = self.feature_extractor.log_mel_frames(tail, center=False)[:, :n_total - a]
+        self.frames.append(log_spec[:, :n_final - a].T)
+
+        log_spec = np.concatenate([self.frames.view().T, log_spec[:, n_final - a:]], axis=1)
+        return self.feature_extractor.normalize(log_spec)
@@ -62,6 +62,14 @@ class HypothesisBuffer:
         self.commited_in_buffer.extend(commit)
         return commit
 
+    def commit_settled(self):
+        # True if inserting more words at the end of self.new can't change what the next flush() commits:
+        # the new words already differ from self.buffer, or they cover all of it.
+        for (_, _, nt), (_, _, bt) in zip(self.new, self.buffer):
+            if nt != bt:
+                return True
+        return len(self.new) >= len(self.buffer)
+
     def pop_commited(self, time):
         while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
             self.commited_in_buffer.pop(0)
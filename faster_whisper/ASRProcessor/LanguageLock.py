@@ -0,0 +1,91 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LanguageLock:
+    """Locks the detected language of a streaming session.
+
+    With language=None, every transcribe call runs the language detection, i.e. an extra encoder pass. The lock
+    counts the confident detections in a row, and after `detections` of them it returns the detected language,
+    which is then passed to the next transcribe calls instead of None. The detection is skipped until a re-check:
+    every `recheck_sec` seconds of audio, or at each VAC utterance boundary with `recheck_utterance`.
+    A confident re-check of another language moves the lock to it.
+    The lock is thread-safe: the ASR processors of a session that finalize utterances in the background share it.
+    """
+
+    STATE = ("locked", "locked_at", "candidate", "count", "recheck")  # the attributes kept by snapshot()
+
+    def __init__(self, detections=3, threshold=0.8, recheck_sec=None, recheck_utterance=False):
+        """detections: number of confident detections of the same language in a row that lock it
+        threshold: minimal language_probability of a confident detection
+        recheck_sec: re-run the detection once per this many seconds of audio after locking. None to never re-check.
+        recheck_utterance: re-run the detection at the start of every utterance detected by VAC
+        """
+        self.detections = detections
+        self.threshold = threshold
+        self.recheck_sec = recheck_sec
+        self.recheck_utterance = recheck_utterance
+        self.mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.mutex:
+            self.locked = None
+            self.locked_at = None
+            self.candidate = None
+            self.count = 0
+            self.recheck = False
+
+    def snapshot(self):
+        """Returns a copy of the state, to be continued by restore()."""
+        with self.mutex:
+            return {k: getattr(self, k) for k in self.STATE}
+
+    def restore(self, state):
+        """Continues from a state returned by snapshot()."""
+        with self.mutex:
+            for k in self.STATE:
+                setattr(self, k, state[k])
+
+    def language(self, now):
+        """Returns the language for the transcribe call at "now" (audio time in seconds), or None to detect it."""
+        with self.mutex:
+            if self.locked is None or self.recheck:
+                return None
+            if self.recheck_sec is not None and now - self.locked_at >= self.recheck_sec:
+                self.recheck = True
+                return None
+            return self.locked
+
+    def request_recheck(self):
+        """the next transcribe call will run the language detection again"""
+        with self.mutex:
+            if self.locked is not None:
+                self.recheck = True
+
+    def update(self, language, language_probability, now):
+        """Reports the result of a transcribe call that ran the language detection."""
+        with self.mutex:
+            if self.recheck:
+                self.recheck = False
+                self.locked_at = now
+                if language != self.locked and language_probability >= self.threshold:
+                    logger.debug(f"language lock moved from {self.locked} to {language} ({language_probability:.2f})")
+                    self.locked = language
+                return
+
+            if language_probability < self.threshold:
+                self.candidate = None
+                self.count = 0
+                return
+            if language == self.candidate:
+                self.count += 1
+            else:
+                self.candidate = language
+                self.count = 1
+            if self.count >= self.detections:
+                logger.debug(f"language locked to {language} after {self.count} detections")
+                self.locked = language
+                self.locked_at = now
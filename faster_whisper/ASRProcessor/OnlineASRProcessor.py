@@ -1,57 +1,153 @@
-import numpy as np
 import sys
+import math
+import time
 import logging
+from collections import deque
+from .AudioBuffer import AudioBuffer
+from .CommittedWords import CommittedWords
+from .FeatureCache import FeatureCache
 from .HypothesisBuffer import HypothesisBuffer
+from .VADCache import VADCache
+from ..utils import StageTimer, timed
 
 logger = logging.getLogger(__name__)
 
 class OnlineASRProcessor:
     SAMPLING_RATE = 16000
 
-    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr):
+    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr, feature_cache=False,
+                 committed_prefix=False, early_stop=False, language_lock=None,
+                 history_sink=None, max_buffer_sec=None,
+                 decoding_policy=None, on_iteration=None, vad_gate=False,
+                 vad_cache=False, excise_silence=None):
         """asr: WhisperASR object
-        tokenizer: sentence tokenizer object for the target language. Must have a method *split* that behaves like the one of MosesTokenizer. It can be None, if "segment" buffer trimming option is used, then tokenizer is not used at all.
+        tokenizer: sentence tokenizer object for the target language, e.g. SentenceSplitter. Must have a method *split* that behaves like the one of MosesTokenizer. It can be None, if "segment" buffer trimming option is used, then tokenizer is not used at all.
         ("segment", 15)
         buffer_trimming: a pair of (option, seconds), where option is either "sentence" or "segment", and seconds is a number. Buffer is trimmed if it is longer than "seconds" threshold. Default is the most recommended option.
         logfile: where to store the log.
+        feature_cache: if True, the log-Mel features of the audio buffer are computed incrementally, only for the newly inserted audio. The buffer is then trimmed at 10 ms boundaries.
+        committed_prefix: if True, the commited text inside the audio buffer is forced as the decoder prefix, so that Whisper decodes only the uncommited tail instead of transcribing the context again.
+        early_stop: if True and the audio buffer is longer than one 30 s window, the decoding of the next windows stops as soon as the words received so far settle what is commited in this iteration. The incomplete tail is then shorter.
+        vad_gate: if True, the new audio is scored by the bundled Silero VAD when it is inserted, and the iterations in which no new audio is voiced and there is no uncommited text to confirm are skipped, without calling Whisper. They are counted in self.skipped_iterations.
+        vad_cache: if True, the speech probabilities of the VAD filter of the ASR (--vad) are computed incrementally, only for the newly inserted audio, by the same VAD as for vad_gate. The buffer is then trimmed at 32 ms boundaries.
+        excise_silence: optional number of seconds. The non-speech spans of the audio buffer longer than that, as detected by the same VAD as for vad_gate, are cut out before transcription, and the timestamps are mapped back to the stream. The buffer trimming thresholds then apply to the transcribed audio, and the buffer is trimmed at 32 ms boundaries.
+        on_iteration: optional callable. It receives the timing record of every iteration, see self.timing_record. The stages are timed only if it is set.
         """
         self.asr = asr
         self.tokenizer = tokenizer
         self.logfile = logfile
+        self.feature_cache = FeatureCache(asr.model.feature_extractor) if feature_cache else None
+        self.committed_prefix = committed_prefix
+        self.early_stop = early_stop
+        self.language_lock = None  # a lock that is passed in is not reset by the first init
+        self.commited = CommittedWords(sink=history_sink)
+        self.max_buffer_sec = max_buffer_sec
+        self.forced_trims = 0
+        self.decoding_policy = decoding_policy
+        self.received = 0  # samples inserted since the last iteration
+        self.on_iteration = on_iteration
+        self.stage_timer = StageTimer() if on_iteration is not None else None
+        self.vad_cache = VADCache() if vad_gate or vad_cache or excise_silence is not None else None
+        self.vad_gate = vad_gate
+        self.vad_probs = vad_cache
+        self.excise_silence = excise_silence
+        # the buffer is trimmed at multiples of the feature frame and VAD window, so that their caches remain valid
+        self.trim_alignment = math.lcm(self.feature_cache.hop_length if self.feature_cache is not None else 1,
+                                       VADCache.WINDOW if vad_cache or excise_silence is not None else 1)
+        self.skipped_iterations = 0
         self.init()
+        self.language_lock = language_lock
         self.buffer_trimming_way, self.buffer_trimming_sec = buffer_trimming
 
-    def init(self, offset=None):
-        """run this when starting or restarting processing"""
-        self.audio_buffer = np.array([], dtype=np.float32)
+    def init(self, offset=None, utterance=False):
+        """run this when starting or restarting processing
+        utterance: True when restarting for the next utterance of the same stream (VAC). The language lock is then
+        kept, and re-checked if it is configured so.
+        """
+        self.audio_buffer = AudioBuffer(capacity=self.SAMPLING_RATE * 8)
         self.transcript_buffer = HypothesisBuffer(logfile=self.logfile)
+        if self.feature_cache is not None:
+            self.feature_cache.reset()
         self.buffer_time_offset = 0
         if offset is not None:
             self.buffer_time_offset = offset
+        if self.vad_cache is not None:
+            self.vad_cache.reset(round(self.buffer_time_offset * self.SAMPLING_RATE))
+            self.transcribed_until = self.vad_cache.start  # stream sample offset of the end of the last transcribed buffer
         self.transcript_buffer.last_commited_time = self.buffer_time_offset
-        self.commited = []
+        self.excised = 0  # samples cut out of the audio buffer in the last iteration
+        self.interim = (None, None, "")  # the uncommited tail of the last transcript, the same format as process_iter
+        self.commited.clear()
+        if self.language_lock is not None:
+            if not utterance:
+                self.language_lock.reset()
+            elif self.language_lock.recheck_utterance:
+                self.language_lock.request_recheck()
+
+    def snapshot(self):
+        """Returns the state of the stream, to be continued by restore(), e.g. when the client reconnects. It holds
+        copies of the audio buffer, the hypothesis buffer, the commited words, and the VAD, language lock and decoding
+        policy state. The cached features are not kept, they are recomputed from the audio.
+        """
+        tb = self.transcript_buffer
+        return dict(
+            audio=self.audio_buffer.view().copy(),
+            offset=self.buffer_time_offset,
+            hypothesis=dict(commited_in_buffer=list(tb.commited_in_buffer), buffer=list(tb.buffer), new=list(tb.new),
+                            last_commited_time=tb.last_commited_time, last_commited_word=tb.last_commited_word),
+            commited=dict(prompt_words=list(self.commited.prompt_words), context=list(self.commited.context),
+                          prompt_len=self.commited.prompt_len),
+            received=self.received,
+            interim=self.interim,
+            vad=self.vad_cache.snapshot() if self.vad_cache is not None else None,
+            transcribed_until=getattr(self, "transcribed_until", None),
+            language_lock=self.language_lock.snapshot() if self.language_lock is not None else None,
+            decoding_policy=self.decoding_policy.snapshot() if self.decoding_policy is not None else None,
+        )
+
+    def restore(self, state):
+        """Continues the stream from a state returned by snapshot(), instead of init(). The words of the interrupted
+        stream are dropped without passing them to the history sink.
+        """
+        self.audio_buffer = AudioBuffer(capacity=max(self.SAMPLING_RATE * 8, len(state["audio"])))
+        self.audio_buffer.append(state["audio"])
+        self.buffer_time_offset = state["offset"]
+        self.transcript_buffer = HypothesisBuffer(logfile=self.logfile)
+        for k, v in state["hypothesis"].items():
+            setattr(self.transcript_buffer, k, list(v) if isinstance(v, list) else v)
+        self.commited.prompt_words = deque(state["commited"]["prompt_words"])
+        self.commited.context = deque(state["commited"]["context"])
+        self.commited.prompt_len = state["commited"]["prompt_len"]
+        if self.feature_cache is not None:
+            self.feature_cache.reset()
+        if self.vad_cache is not None and state["vad"] is not None:
+            self.vad_cache.restore(state["vad"])
+            self.transcribed_until = state["transcribed_until"]
+        elif self.vad_cache is not None:  # the VAD didn't run in the interrupted stream, it starts at the buffer
+            self.vad_cache.reset(round(self.buffer_time_offset * self.SAMPLING_RATE))
+            self.vad_cache.append(self.audio_buffer.view())
+            self.transcribed_until = self.vad_cache.start
+        if self.language_lock is not None and state["language_lock"] is not None:
+            self.language_lock.restore(state["language_lock"])
+        if self.decoding_policy is not None and state["decoding_policy"] is not None:
+            self.decoding_policy.restore(state["decoding_policy"])
+        self.received = state["received"]
+        self.interim = state["interim"]
+        self.excised = 0
 
     def insert_audio_chunk(self, audio):
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
+        self.received += len(audio)
+        if self.vad_cache is not None:
+            self.vad_cache.append(audio)
 
     def prompt(self):
         """Returns a tuple: (prompt, context), where "prompt" is a 200-character suffix of commited text that is inside of the scrolled away part of audio buffer.
-        "context" is the commited text that is inside the audio buffer. It is transcribed again and skipped. It is returned only for debugging and logging reasons.
+        "context" is the commited text that is inside the audio buffer. It is transcribed again and skipped, or forced as the decoder prefix if committed_prefix is set.
         """
-        k = max(0, len(self.commited) - 1)
-        while k > 0 and self.commited[k - 1][1] > self.buffer_time_offset:
-            k -= 1
-
-        p = self.commited[:k]
-        p = [t for _, _, t in p]
-        prompt = []
-        l = 0
-        while p and l < 200:  # 200 characters prompt size
-            x = p.pop(-1)
-            l += len(x) + 1
-            prompt.append(x)
-        non_prompt = self.commited[k:]
-        return self.asr.sep.join(prompt[::-1]), self.asr.sep.join(t for _, _, t in non_prompt)
+        self.commited.advance(self.buffer_time_offset)
+        prompt = self.asr.sep.join(t for _, _, t in self.commited.prompt_words)
+        return prompt, self.asr.sep.join(t for _, _, t in self.commited.context)
 
     def process_iter(self):
         """Runs on the current audio buffer.
@@ -59,28 +155,61 @@ class OnlineASRProcessor:
         The non-emty text is confirmed (committed) partial transcript.
         """
 
+        if self.vad_gate and self.skip_iteration():
+            return (None, None, "")
+
+        start = time.perf_counter()
+        options = dict(self.decoding_policy.options()) if self.decoding_policy is not None else {}
         prompt, non_prompt = self.prompt()
         logger.debug(f"PROMPT: {prompt}")
         logger.debug(f"CONTEXT: {non_prompt}")
         logger.debug(
             f"transcribing {len(self.audio_buffer) / self.SAMPLING_RATE:2.2f} seconds from {self.buffer_time_offset:2.2f}")
-        res = self.asr.transcribe(self.audio_buffer, init_prompt=prompt)
+        audio = self.audio_buffer.view()
+        now = self.buffer_time_offset + len(audio) / self.SAMPLING_RATE
+        speech_chunks = self.speech_chunks(audio) if self.excise_silence is not None else None
+        if speech_chunks is not None:
+            audio = self.excise(audio, speech_chunks)
+            if self.asr.transcribe_kargs.get("vad_filter"):
+                options["vad_filter"] = False  # the silence is cut out already
+        self.excised = len(self.audio_buffer) - len(audio)
+        if self.stage_timer is not None:
+            self.stage_timer.reset()
+            options["stage_timer"] = self.stage_timer
+        with timed(self.stage_timer, "features"):
+            # the cached features are of the whole buffer, the excised audio is processed from scratch
+            features = self.feature_cache(audio) if self.feature_cache is not None and not self.excised else None
+        if self.vad_probs and not self.excised:
+            options["vad_speech_probs"] = self.vad_cache.probs[
+                (round(self.buffer_time_offset * self.SAMPLING_RATE) - self.vad_cache.start) // VADCache.WINDOW:]
+        prefix = non_prompt if self.committed_prefix else None
+        language = self.language_lock.language(now) if self.language_lock is not None else None
+        segments, info = self.asr.transcribe_stream(audio, init_prompt=prompt, features=features, prefix=prefix,
+                                                    language=language, **options)
+        if self.language_lock is not None and language is None:
+            self.language_lock.update(info.language, info.language_probability, now)
+        if speech_chunks is not None:
+            from ..transcribe import restore_speech_timestamps
+            segments = restore_speech_timestamps(segments, speech_chunks, self.SAMPLING_RATE)
+        res = self.consume_segments(segments, len(audio))
 
         # transform to [(beg,end,"word1"), ...]
         tsw = self.asr.ts_words(res)
 
-        self.transcript_buffer.insert(tsw, self.buffer_time_offset)
-        o = self.transcript_buffer.flush()
+        with timed(self.stage_timer, "hypothesis"):
+            self.transcript_buffer.insert(tsw, self.buffer_time_offset)
+            o = self.transcript_buffer.flush()
         self.commited.extend(o)
         completed = self.to_flush(o)
         logger.debug(f">>>>COMPLETE NOW: {completed}")
         the_rest = self.to_flush(self.transcript_buffer.complete())
         logger.debug(f"INCOMPLETE: {the_rest}")
+        self.interim = the_rest
 
         # there is a newly confirmed text
 
         if o and self.buffer_trimming_way == "sentence":  # trim the completed sentences
-            if len(self.audio_buffer) / self.SAMPLING_RATE > self.buffer_trimming_sec:  # longer than this
+            if self.transcribed_length() > self.buffer_trimming_sec:  # longer than this
                 self.chunk_completed_sentence()
 
         if self.buffer_trimming_way == "segment":
@@ -88,7 +217,7 @@ class OnlineASRProcessor:
         else:
             s = 30  # if the audio buffer is longer than 30s, trim it
 
-        if len(self.audio_buffer) / self.SAMPLING_RATE > s:
+        if self.transcribed_length() > s:
             self.chunk_completed_segment(res)
 
             # alternative: on any word
@@ -101,27 +230,131 @@ class OnlineASRProcessor:
             logger.debug("chunking segment")
             # self.chunk_at(t)
 
+        if self.max_buffer_sec is not None and len(self.audio_buffer) / self.SAMPLING_RATE > self.max_buffer_sec:
+            self.chunk_forced()
+
         logger.debug(f"len of buffer now: {len(self.audio_buffer) / self.SAMPLING_RATE:2.2f}")
+        elapsed = time.perf_counter() - start
+        if self.decoding_policy is not None:
+            self.decoding_policy.update(elapsed, self.received / self.SAMPLING_RATE)
+        if self.on_iteration is not None:
+            self.on_iteration(self.timing_record(now, len(audio), elapsed, o))
+        self.received = 0
         return self.to_flush(o)
 
+    def timing_record(self, now, n_samples, elapsed, committed):
+        """Returns the timing record of the iteration: a dict with
+        "time": end of the processed audio buffer, in seconds of the stream
+        "buffer": length of the processed audio buffer in seconds
+        "received": seconds of audio inserted since the previous iteration
+        "total": wall-clock duration of the iteration in seconds
+        "stages": durations of the stages in seconds, e.g. features, encode, decode, align, hypothesis
+        "windows", "tokens", "fallbacks": decoded 30 s windows, generated tokens and temperature fallbacks
+        "commit_delay": the longest time from the end of a newly commited word to the end of the buffer, None if nothing was commited
+        """
+        counters = self.stage_timer.counters
+        return {
+            "time": now,
+            "buffer": n_samples / self.SAMPLING_RATE,
+            "received": self.received / self.SAMPLING_RATE,
+            "total": elapsed,
+            "stages": dict(self.stage_timer.durations),
+            "windows": counters.get("windows", 0),
+            "tokens": counters.get("tokens", 0),
+            "fallbacks": counters.get("fallbacks", 0),
+            "commit_delay": max((now - e for _, e, _ in committed), default=None),
+        }
+
+    def skip_iteration(self):
+        """Whether the iteration can be skipped by the VAD gate: nothing voiced was inserted since the last transcribed
+        buffer, and all the transcribed words are commited. The silence is then trimmed from the long buffer, but not
+        the voiced audio after the last commited word, which Whisper didn't transcribe to any word yet.
+        """
+        if self.vad_cache.voiced_since(self.transcribed_until) or self.transcript_buffer.buffer:
+            self.transcribed_until = self.vad_cache.end
+            return False
+        self.skipped_iterations += 1
+        self.received = 0
+        logger.debug(f"no new voice, skipping the iteration, skipped: {self.skipped_iterations}")
+        if len(self.audio_buffer) / self.SAMPLING_RATE > self.buffer_trimming_sec:
+            # the transcribed words are commited and the rest is silent, keep 1 second for a possible speech start
+            t = self.buffer_time_offset + len(self.audio_buffer) / self.SAMPLING_RATE - 1
+            handled = self.commited[-1][1] if self.commited else self.buffer_time_offset
+            voiced = self.vad_cache.last_voiced
+            if voiced is not None and voiced / self.SAMPLING_RATE > handled + 1:
+                # it is kept to be transcribed again with the next speech, or trimmed by max_buffer_sec
+                t = handled
+            if t > self.buffer_time_offset:
+                self.chunk_at(t)
+        return True
+
+    def transcribed_length(self):
+        """length of the audio buffer in seconds, without the silence excised in the last iteration"""
+        return max(0, len(self.audio_buffer) - self.excised) / self.SAMPLING_RATE
+
+    def speech_chunks(self, audio):
+        """Returns the speech chunks of the audio buffer, [{"start": sample, "end": sample}, ...], by the cached speech
+        probabilities, or None if there is no silence longer than excise_silence to cut out. The audio after the scored
+        VAD windows is kept, because it may be a beginning of speech.
+        """
+        from ..vad import VadOptions, get_speech_timestamps
+        first = (round(self.buffer_time_offset * self.SAMPLING_RATE) - self.vad_cache.start) // VADCache.WINDOW
+        probs = self.vad_cache.probs[first:]
+        scored = len(probs) * VADCache.WINDOW
+        vad_options = VadOptions(threshold=self.vad_cache.threshold,
+                                 min_silence_duration_ms=int(self.excise_silence * 1000))
+        chunks = get_speech_timestamps(audio[:scored], vad_options, self.SAMPLING_RATE, speech_probs=probs)
+        tail = max(0, scored - vad_options.speech_pad_ms * self.SAMPLING_RATE // 1000)
+        while chunks and chunks[-1]["end"] >= tail:
+            tail = min(tail, chunks.pop()["start"])
+        chunks.append({"start": tail, "end": len(audio)})
+        speech = sum(c["end"] - c["start"] for c in chunks)
+        if len(audio) - speech < self.excise_silence * self.SAMPLING_RATE:
+            return None
+        return chunks
+
+    def excise(self, audio, speech_chunks):
+        """Returns the speech chunks of audio concatenated."""
+        from ..vad import collect_chunks
+        excised = collect_chunks(audio, speech_chunks, self.SAMPLING_RATE)[0][0]
+        logger.debug(f"silence excised: {(len(audio) - len(excised)) / self.SAMPLING_RATE:2.2f} s, "
+                     f"transcribing {len(excised) / self.SAMPLING_RATE:2.2f} s of speech")
+        return excised
+
+    def consume_segments(self, segments, n_samples):
+        """Collects the segments from the lazy generator. With early_stop, the words are inserted into the hypothesis buffer
+        segment by segment, and the generator is closed when the commit of this iteration can't change anymore.
+        """
+        if not self.early_stop or n_samples <= self.asr.model.feature_extractor.n_samples:
+            return list(segments)  # a single window is decoded at once, there is nothing to skip
+        res = []
+        for segment in segments:
+            res.append(segment)
+            self.transcript_buffer.insert(self.asr.ts_words(res), self.buffer_time_offset)
+            if self.transcript_buffer.commit_settled():
+                segments.close()
+                logger.debug(f"commit settled at {segment.end:2.2f}, skipping the rest of the buffer")
+                break
+        return res
+
     def chunk_completed_sentence(self):
-        if self.commited == []: return
-        logger.debug(self.commited)
+        if not self.commited: return
+        logger.debug(list(self.commited))
         sents = self.words_to_sentences(self.commited)
         for s in sents:
             logger.debug(f"\t\tSENT: {s}")
         if len(sents) < 2:
             return
-        while len(sents) > 2:
-            sents.pop(0)
         # we will continue with audio processing at this timestamp
         chunk_at = sents[-2][1]
+        if chunk_at <= self.buffer_time_offset:
+            return
 
         logger.debug(f"--- sentence chunked at {chunk_at:2.2f}")
         self.chunk_at(chunk_at)
 
     def chunk_completed_segment(self, res):
-        if self.commited == []: return
+        if not self.commited: return
 
         ends = self.asr.segments_end_ts(res)
 
@@ -141,36 +374,53 @@ class OnlineASRProcessor:
         else:
             logger.debug(f"--- not enough segments to chunk")
 
+    def chunk_forced(self):
+        """trims the buffer at the end of the last commited word, when the sentence/segment trimming didn't"""
+        if not self.commited or self.commited[-1][1] <= self.buffer_time_offset:
+            logger.debug(f"--- buffer over {self.max_buffer_sec:2.2f} s, but no commited word to trim at")
+            return
+        t = self.commited[-1][1]
+        self.forced_trims += 1
+        logger.debug(f"--- forced trim at {t:2.2f}, forced trims: {self.forced_trims}")
+        self.chunk_at(t)
+
     def chunk_at(self, time):
-        """trims the hypothesis and audio buffer at "time"
+        """trims the hypothesis and audio buffer at "time", aligned down to trim_alignment samples
         """
-        self.transcript_buffer.pop_commited(time)
         cut_seconds = time - self.buffer_time_offset
-        self.audio_buffer = self.audio_buffer[int(cut_seconds * self.SAMPLING_RATE):]
+        cut = int(cut_seconds * self.SAMPLING_RATE)
+        if self.trim_alignment > 1:
+            cut -= cut % self.trim_alignment
+            time = self.buffer_time_offset + cut / self.SAMPLING_RATE
+        self.transcript_buffer.pop_commited(time)
+        if self.feature_cache is not None:
+            self.feature_cache.trim(cut)
+        self.audio_buffer.trim(cut)
         self.buffer_time_offset = time
+        if self.vad_cache is not None:
+            self.vad_cache.trim(round(time * self.SAMPLING_RATE))
 
     def words_to_sentences(self, words):
         """Uses self.tokenizer for sentence segmentation of words.
         Returns: [(beg,end,"sentence 1"),...]
         """
 
-        cwords = [w for w in words]
-        t = " ".join(o[2] for o in cwords)
-        s = self.tokenizer.split(t)
+        cwords = list(words)
+        t = " ".join(o[2].strip() for o in cwords)
         out = []
-        while s:
-            beg = None
-            end = None
-            sent = s.pop(0).strip()
+        i = 0
+        for sent in self.tokenizer.split(t):
+            sent = sent.strip()
             fsent = sent
-            while cwords:
-                b, e, w = cwords.pop(0)
+            beg = None
+            while i < len(cwords):
+                b, e, w = cwords[i]
+                i += 1
                 w = w.strip()
                 if beg is None and sent.startswith(w):
                     beg = b
-                elif end is None and sent == w:
-                    end = e
-                    out.append((beg, end, fsent))
+                if sent == w:
+                    out.append((beg, e, fsent))
                     break
                 sent = sent[len(w):].strip()
         return out
@@ -182,6 +432,7 @@ class OnlineASRProcessor:
         o = self.transcript_buffer.complete()
         f = self.to_flush(o)
         logger.debug(f"last, noncommited: {f}")
+        self.interim = (None, None, "")
         self.buffer_time_offset += len(self.audio_buffer) / 16000
         return f
 
@@ -0,0 +1,31 @@
+import re
+
+
+class SentenceSplitter:
+    """Punctuation-based sentence segmenter, a dependency-free replacement of MosesTokenizer for "sentence" buffer trimming.
+
+    A sentence ends with Latin punctuation (. ! ? ...) followed by whitespace and a word that doesn't start with a
+    lowercase letter of any script, or by the end of the text, e.g. "e.g. this" and "etc.  über" are not split.
+    CJK marks (。！？) end a sentence regardless of what follows. Closing quotes and brackets after the mark belong to
+    the sentence.
+    It runs in linear time of the text length.
+    """
+
+    LATIN_END = r"[.!?…]+[\"'”’»)\]]*(?=\s|$)"
+    CJK_END = r"[。！？]+[」』”’）]*"
+
+    def __init__(self):
+        self.pattern = re.compile(f"(?P<latin>{self.LATIN_END})|{self.CJK_END}")
+        self.next_word = re.compile(r"\s*(\S?)")
+
+    def split(self, text):
+        """Returns the list of sentences of text, stripped of the surrounding whitespace."""
+        sentences = []
+        beg = 0
+        for m in self.pattern.finditer(text):
+            if m.group("latin") and self.next_word.match(text, m.end()).group(1).islower():
+                continue
+            sentences.append(text[beg:m.end()].strip())
+            beg = m.end()
+        sentences.append(text[beg:].strip())
+        return [s for s in sentences if s]
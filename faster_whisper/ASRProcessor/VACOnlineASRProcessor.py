@@ -1,55 +1,142 @@
-import numpy as np
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from .AudioBuffer import AudioBuffer
 from .OnlineASRProcessor import OnlineASRProcessor
+from .VADWorker import VADWorker
 class VACOnlineASRProcessor(OnlineASRProcessor):
     '''Wraps ASRProcessor with VAC (oice Activity ControllerV).
 
     It works the same way as ASRProcessor: it receives chunks of audio (e.g. 0.04 seconds),
     it runs VAD and continuously detects whether there is speech or not.
     When it detects end of speech (non-voice for 500ms), it makes ASRProcessor to end the utterance immediately.
+
+    With vad_thread, VAD runs on a VADWorker thread, so it continues during a long Whisper decode. The VAD results
+    are applied in process_iter, up to the end of the first finished utterance, which is then flushed immediately.
+
+    With pipelined_finish, a finished utterance is finalized in the background: its ASR processor decodes the audio
+    received since its last iteration and flushes the rest of the transcript, while the next utterance is already
+    processed by another ASR processor. The outputs are emitted in order, an interim output of the next utterance
+    waits for the final output of the previous one.
     '''
 
-    def __init__(self, online_chunk_size, *a, **kw):
+    def __init__(self, online_chunk_size, *a, vad_thread=False, pipelined_finish=False, **kw):
         self.online_chunk_size = online_chunk_size
+        self.vad_thread = vad_thread
+        self.vad_worker = None
 
+        self.online_args = (a, kw)
         self.online = OnlineASRProcessor(*a, **kw)
+        self.finalizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VACFinalizer") if pipelined_finish else None
+        self.idle = []  # ASR processors of the finalized utterances, to be reused, only by the caller's thread
+        self.outputs = deque()  # outputs waiting for the finalization of an earlier utterance, and its futures
 
-        # VAC:
-        import torch
-        model, _ = torch.hub.load(
-            repo_or_dir='snakers4/silero-vad',
-            model='silero_vad'
-        )
+        # VAC: the bundled silero ONNX model, with the state kept between the chunks
+        from ..vad import StreamingSileroVAD
         from ..silero_vad_iterator import FixedVADIterator
-        self.vac = FixedVADIterator(model)  # we use the default options there: 500ms silence, 100ms padding, etc.
+        self.vac = FixedVADIterator(StreamingSileroVAD())  # we use the default options there: 500ms silence, 100ms padding, etc.
 
         self.logfile = self.online.logfile
         self.init()
 
     def init(self):
+        if self.outputs:
+            wait([o for o in self.outputs if isinstance(o, Future)])
+            for o in self.outputs:
+                if isinstance(o, Future) and o.exception() is None:
+                    self.idle.append(o.result()[1])
+            self.outputs.clear()
         self.online.init()
+        if self.vad_worker is not None:
+            self.vad_worker.stop()
+            self.vad_worker = None
         self.vac.reset_states()
+        if self.vad_thread:
+            self.vad_worker = VADWorker(self.vac)
         self.current_online_chunk_buffer_size = 0
 
         self.is_currently_final = False
 
         self.status = None  # or "voice" or "nonvoice"
-        self.audio_buffer = np.array([], dtype=np.float32)
+        self.audio_buffer = AudioBuffer(capacity=self.SAMPLING_RATE * 2)
         self.buffer_offset = 0  # in frames
 
+    def snapshot(self):
+        """Returns the state of the stream, to be continued by restore(): the VAC buffer and VAD state, the ASR
+        processor of the current utterance, and the outputs of the finished utterances that were not returned yet.
+        """
+        vad_results = self.vad_worker.drain() if self.vad_worker is not None else []
+        outputs = []
+        for o in self.outputs:
+            o = o.result()[0] if isinstance(o, Future) else o
+            if o[0] is not None:
+                outputs.append(o)
+        return dict(
+            online=self.online.snapshot(),
+            vac=self.vac.snapshot(),
+            vad_results=[(a.copy(), r) for a, r in vad_results],
+            outputs=outputs,
+            audio=self.audio_buffer.view().copy(),
+            buffer_offset=self.buffer_offset,
+            status=self.status,
+            is_currently_final=self.is_currently_final,
+            current_online_chunk_buffer_size=self.current_online_chunk_buffer_size,
+        )
+
+    def restore(self, state):
+        """continues the stream from a state returned by snapshot(), instead of init()"""
+        self.init()
+        self.online.restore(state["online"])
+        self.vac.restore(state["vac"])
+        self.outputs.extend(state["outputs"])
+        self.audio_buffer.append(state["audio"])
+        self.buffer_offset = state["buffer_offset"]
+        self.status = state["status"]
+        self.is_currently_final = state["is_currently_final"]
+        self.current_online_chunk_buffer_size = state["current_online_chunk_buffer_size"]
+        if self.vad_worker is not None:
+            self.vad_worker.requeue(state["vad_results"])
+        else:
+            for audio, res in state["vad_results"]:
+                self.apply_vad_result(audio, res)
+
+    @property
+    def interim(self):
+        """the uncommited tail of the current utterance, empty while an earlier utterance is being finalized"""
+        if self.outputs:
+            return (None, None, "")
+        return self.online.interim
+
     def clear_buffer(self):
         self.buffer_offset += len(self.audio_buffer)
-        self.audio_buffer = np.array([], dtype=np.float32)
+        self.audio_buffer.clear()
 
     def insert_audio_chunk(self, audio):
-        res = self.vac(audio)
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        if self.vad_worker is not None:
+            self.vad_worker.put(audio)
+        else:
+            self.apply_vad_result(audio, self.vac(audio))
+
+    def apply_vad(self, block=False):
+        """Applies the results of the VAD worker that are ready, until the end of an utterance.
+        block: wait for all the audio inserted so far
+        """
+        if block:
+            self.vad_worker.wait()
+        while not self.is_currently_final:
+            r = self.vad_worker.get()
+            if r is None:
+                return
+            self.apply_vad_result(*r)
+
+    def apply_vad_result(self, audio, res):
+        self.audio_buffer.append(audio)
 
         if res is not None:
             frame = list(res.values())[0] - self.buffer_offset
             if 'start' in res and 'end' not in res:
                 self.status = 'voice'
                 send_audio = self.audio_buffer[frame:]
-                self.online.init(offset=(frame + self.buffer_offset) / self.SAMPLING_RATE)
+                self.online.init(offset=(frame + self.buffer_offset) / self.SAMPLING_RATE, utterance=True)
                 self.online.insert_audio_chunk(send_audio)
                 self.current_online_chunk_buffer_size += len(send_audio)
                 self.clear_buffer()
@@ -65,36 +152,87 @@ class VACOnlineASRProcessor(OnlineASRProcessor):
                 end = res["end"] - self.buffer_offset
                 self.status = 'nonvoice'
                 send_audio = self.audio_buffer[beg:end]
-                self.online.init(offset=(beg + self.buffer_offset) / self.SAMPLING_RATE)
+                self.online.init(offset=(beg + self.buffer_offset) / self.SAMPLING_RATE, utterance=True)
                 self.online.insert_audio_chunk(send_audio)
                 self.current_online_chunk_buffer_size += len(send_audio)
                 self.is_currently_final = True
                 self.clear_buffer()
         else:
             if self.status == 'voice':
-                self.online.insert_audio_chunk(self.audio_buffer)
+                self.online.insert_audio_chunk(self.audio_buffer.view())
                 self.current_online_chunk_buffer_size += len(self.audio_buffer)
                 self.clear_buffer()
             else:
                 # We keep 1 second because VAD may later find start of voice in it.
                 # But we trim it to prevent OOM.
                 self.buffer_offset += max(0, len(self.audio_buffer) - self.SAMPLING_RATE)
-                self.audio_buffer = self.audio_buffer[-self.SAMPLING_RATE:]
+                self.audio_buffer.keep_last(self.SAMPLING_RATE)
 
     def process_iter(self):
+        if self.vad_worker is not None:
+            self.apply_vad()
+        if self.is_currently_final and self.finalizer is not None:
+            self.finish_in_background()
+            return self.emit()
         if self.is_currently_final:
             return self.finish()
         elif self.current_online_chunk_buffer_size > self.SAMPLING_RATE * self.online_chunk_size:
             self.current_online_chunk_buffer_size = 0
             ret = self.online.process_iter()
-            return ret
+            return self.emit(ret)
         else:
             print("no online update, only VAD", self.status, file=self.logfile)
-            return (None, None, "")
+            return self.emit()
+
+    def finish_in_background(self):
+        """hands the finished utterance over to the finalizer, and continues with another ASR processor"""
+        online = self.online
+        self.outputs.append(self.finalizer.submit(self.finalize, online))
+        if self.idle:
+            self.online = self.idle.pop()
+        else:
+            # the decoding policy and the language lock of the session are shared with the finalizer thread,
+            # they are thread-safe
+            a, kw = self.online_args
+            self.online = OnlineASRProcessor(*a, **kw)
+            self.online.language_lock = online.language_lock
+        self.online.init(offset=online.buffer_time_offset + len(online.audio_buffer) / self.SAMPLING_RATE,
+                         utterance=True)
+        self.current_online_chunk_buffer_size = 0
+        self.is_currently_final = False
+
+    def finalize(self, online):
+        """Runs on the finalizer thread. Returns the final output and the ASR processor, which is reused after the
+        output is emitted."""
+        o = online.process_iter() if online.received else (None, None, "")
+        f = online.finish()
+        return online.to_flush([r for r in (o, f) if r[0] is not None]), online
+
+    def emit(self, ret=(None, None, "")):
+        """Returns ret, preceded by the outputs of the earlier utterances. If an earlier utterance is still being
+        finalized, ret is kept for later and the ready outputs before it are returned.
+        """
+        if not self.outputs:
+            return ret
+        if ret[0] is not None:
+            self.outputs.append(ret)
+        ready = []
+        while self.outputs and (not isinstance(self.outputs[0], Future) or self.outputs[0].done()):
+            o = self.outputs.popleft()
+            if isinstance(o, Future):
+                o, online = o.result()
+                self.idle.append(online)
+            if o[0] is not None:
+                ready.append(o)
+        return self.online.to_flush(ready)
 
     def finish(self):
+        if self.vad_worker is not None and not self.is_currently_final:
+            self.apply_vad(block=True)
         ret = self.online.finish()
         self.current_online_chunk_buffer_size = 0
         self.is_currently_final = False
+        if self.outputs:
+            wait([o for o in self.outputs if isinstance(o, Future)])
+            ret = self.emit(ret)
         return ret
-
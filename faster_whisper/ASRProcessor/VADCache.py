@@ -0,0 +1,77 @@
+import numpy as np
+from .AudioBuffer import AudioBuffer
+
+
+class VADCache:
+    """Speech probabilities of the streaming audio, computed incrementally by the bundled Silero VAD.
+
+    The stream is scored in windows of 512 samples, every window only once, when it is complete. The model keeps its
+    state between the calls, see StreamingSileroVAD. The probabilities are stored by the window index in the stream.
+    """
+
+    WINDOW = 512
+
+    def __init__(self, threshold=0.5, vad=None):
+        """threshold: speech probability threshold of a voiced window
+        vad: StreamingSileroVAD, a new one on the bundled model if None
+        """
+        if vad is None:
+            from ..vad import StreamingSileroVAD
+            vad = StreamingSileroVAD()
+        self.vad = vad
+        self.threshold = threshold
+        self.probs = AudioBuffer(capacity=16000 * 30 // self.WINDOW)
+        self.pending = AudioBuffer(capacity=self.WINDOW * 4)
+        self.reset()
+
+    def reset(self, sample=0):
+        """starts a new stream at the stream sample offset "sample" """
+        self.vad.reset_states()
+        self.probs.clear()
+        self.pending.clear()
+        self.start = sample  # stream sample offset of self.probs[0]
+        self.last_voiced = None  # stream sample offset of the end of the last voiced window
+
+    def snapshot(self):
+        """Returns a copy of the state: the probabilities, the unscored audio and the VAD model state."""
+        return dict(probs=self.probs.view().copy(), pending=self.pending.view().copy(), start=self.start,
+                    last_voiced=self.last_voiced, vad=self.vad.snapshot())
+
+    def restore(self, state):
+        """continues from a state returned by snapshot()"""
+        self.vad.restore(state["vad"])
+        self.probs.clear()
+        self.probs.append(state["probs"])
+        self.pending.clear()
+        self.pending.append(state["pending"])
+        self.start = state["start"]
+        self.last_voiced = state["last_voiced"]
+
+    @property
+    def end(self):
+        """stream sample offset of the end of the scored windows"""
+        return self.start + len(self.probs) * self.WINDOW
+
+    def append(self, audio):
+        """scores the complete windows of the pending and newly appended audio"""
+        self.pending.append(audio)
+        n = len(self.pending) - len(self.pending) % self.WINDOW
+        if n == 0:
+            return
+        probs = self.vad(self.pending[:n])
+        self.pending.trim(n)
+        voiced = np.flatnonzero(probs >= self.threshold)
+        if len(voiced):
+            self.last_voiced = self.end + (voiced[-1] + 1) * self.WINDOW
+        self.probs.append(probs)
+
+    def voiced_since(self, sample):
+        """whether a window that ends after the stream sample offset "sample" is voiced"""
+        return self.last_voiced is not None and self.last_voiced > sample
+
+    def trim(self, sample):
+        """drops the probabilities of the windows that end before the stream sample offset "sample" """
+        n = min(len(self.probs), (sample - self.start) // self.WINDOW)
+        if n > 0:
+            self.probs.trim(n)
+            self.start += n * self.WINDOW
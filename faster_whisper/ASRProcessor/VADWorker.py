@@ -0,0 +1,69 @@
+import queue
+import threading
+
+
+class VADWorker:
+    """Runs the VAD iterator on its own thread.
+
+    The audio chunks put into the worker are processed in order, and the pairs (chunk, VAD result) are published
+    through the output queue as soon as they are ready, also while the thread of the caller is blocked in a Whisper
+    decode. An exception of the VAD iterator is published instead of the result, and re-raised by get().
+    """
+
+    def __init__(self, vac):
+        """vac: VAD iterator, e.g. FixedVADIterator. It must not be used by another thread while the worker runs."""
+        self.vac = vac
+        self.input = queue.Queue()
+        self.output = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="VADWorker", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            audio = self.input.get()
+            try:
+                if audio is None:
+                    return
+                try:
+                    self.output.put((audio, self.vac(audio)))
+                except Exception as e:
+                    self.output.put((audio, e))
+            finally:
+                self.input.task_done()
+
+    def put(self, audio):
+        """audio: chunk to process, it must not be modified afterwards"""
+        self.input.put(audio)
+
+    def get(self, block=False):
+        """Returns the next (chunk, VAD result), or None if there is no result ready and block is False."""
+        try:
+            audio, res = self.output.get(block=block)
+        except queue.Empty:
+            return None
+        if isinstance(res, Exception):
+            raise res
+        return audio, res
+
+    def drain(self):
+        """Waits for all the chunks put so far, and returns the list of all the (chunk, VAD result) not got yet."""
+        self.wait()
+        results = []
+        while True:
+            r = self.get()
+            if r is None:
+                return results
+            results.append(r)
+
+    def requeue(self, results):
+        """Puts the (chunk, VAD result) pairs returned by drain() back in front of the output. Call it before put()."""
+        for r in results:
+            self.output.put(r)
+
+    def wait(self):
+        """blocks until all the chunks put so far are processed"""
+        self.input.join()
+
+    def stop(self):
+        self.input.put(None)
+        self.thread.join()
@@ -1,7 +1,13 @@
 from .VACOnlineASRProcessor import VACOnlineASRProcessor
 from .OnlineASRProcessor import OnlineASRProcessor
+from .LanguageLock import LanguageLock
+from .DecodingPolicy import DecodingPolicy
+from .SentenceSplitter import SentenceSplitter
 
 __all__ = [
     "VACOnlineASRProcessor",
-    "OnlineASRProcessor"
+    "OnlineASRProcessor",
+    "LanguageLock",
+    "DecodingPolicy",
+    "SentenceSplitter",
 ]
\ No newline at end of file
@@ -4,7 +4,8 @@ logger = logging.getLogger(__name__)
 class FasterWhisperASR():
     """Uses faster-whisper library as the backend. Works much faster, appx 4-times (in offline mode). For GPU, it requires installation with a specific CUDNN version.
     """
-    def __init__(self, lan, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr):
+    def __init__(self, lan, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr, num_workers=1):
+        """num_workers: number of transcribe calls that the model runs in parallel, when it is called from multiple threads"""
         self.logfile = logfile
 
         self.transcribe_kargs = {}
@@ -13,11 +14,11 @@ class FasterWhisperASR():
         else:
             self.original_language = lan
 
-        self.model = self.load_model(modelsize, cache_dir, model_dir)
+        self.model = self.load_model(modelsize, cache_dir, model_dir, num_workers=num_workers)
 
     sep = ""
 
-    def load_model(self, modelsize=None, cache_dir=None, model_dir=None):
+    def load_model(self, modelsize=None, cache_dir=None, model_dir=None, num_workers=1):
         from ..transcribe import WhisperModel
         #        logging.getLogger("faster_whisper").setLevel(logger.level)
         if model_dir is not None:
@@ -30,7 +31,8 @@ class FasterWhisperASR():
             raise ValueError("modelsize or model_dir parameter must be set")
 
         # this worked fast and reliably on NVIDIA L40
-        model = WhisperModel(model_size_or_path, device="cuda", compute_type="int8", download_root=cache_dir)
+        model = WhisperModel(model_size_or_path, device="cuda", compute_type="int8", download_root=cache_dir,
+                             num_workers=num_workers)
 
         # or run on GPU with INT8
         # tested: the transcripts were different, probably worse than with FP16, and it was slightly (appx 20%) slower
@@ -41,15 +43,27 @@ class FasterWhisperASR():
         #        model = WhisperModel(modelsize, device="cpu", compute_type="int8") #, download_root="faster-disk-cache-dir/")
         return model
 
-    def transcribe(self, audio, init_prompt=""):
-
-        # tested: beam_size=5 is faster and better than 1 (on one 200 second document from En ESIC, min chunk 0.01)
-        segments, info = self.model.transcribe(audio, language=self.original_language, initial_prompt=init_prompt,
-                                               beam_size=5, word_timestamps=True, condition_on_previous_text=True,
-                                               **self.transcribe_kargs)
+    def transcribe(self, audio, init_prompt="", features=None, prefix=None, language=None, **options):
+        segments, info = self.transcribe_stream(audio, init_prompt=init_prompt, features=features, prefix=prefix,
+                                                language=language, **options)
         # print(info)  # info contains language detection result
         return list(segments)
 
+    def transcribe_stream(self, audio, init_prompt="", features=None, prefix=None, language=None, **options):
+        """Returns (segments, info) where segments is the lazy generator of WhisperModel.transcribe. Every 30 s
+        window is decoded only when its first segment is requested, and the decoding stops when the generator is closed.
+        features: optional log-Mel features of audio, e.g. from a streaming FeatureCache
+        prefix: optional text that is forced at the beginning of the transcript, only the rest is decoded
+        language: overrides the language of the ASR for this call, e.g. the one locked by a LanguageLock
+        options: override the decoding options of WhisperModel.transcribe for this call, e.g. from a DecodingPolicy
+        """
+        # tested: beam_size=5 is faster and better than 1 (on one 200 second document from En ESIC, min chunk 0.01)
+        kwargs = dict(beam_size=5, word_timestamps=True, condition_on_previous_text=True)
+        kwargs.update(self.transcribe_kargs)
+        kwargs.update(options)
+        return self.model.transcribe(audio, language=language or self.original_language, initial_prompt=init_prompt,
+                                     prefix=prefix or None, features=features, **kwargs)
+
     def ts_words(self, segments):
         o = []
         for segment in segments:
@@ -0,0 +1,294 @@
+import functools
+import inspect
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import replace
+
+import numpy as np
+
+from ..utils import timed
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+class MicroBatchASR:
+    """Shares one FasterWhisperASR between concurrent streaming sessions, and batches their transcribe calls.
+
+    The transcribe_stream calls of the sessions, made from their own threads, are queued. A scheduler thread takes
+    the first waiting call, collects the calls that arrive within `window` seconds after it, up to `max_batch`, and
+    processes the calls with the same language and decoding options together: their padded features are stacked
+    into one encode, one generate runs with the per-session prompts, and the word alignment runs for the batch. Then
+    the segments are returned to the sessions. A longer window makes bigger batches, and adds latency.
+
+    Only the calls of one 30 s window with a known language are batched, and they are decoded at the first
+    temperature. A call that needs the temperature fallback by the thresholds of its options is repeated by the ASR
+    directly, as well as the other calls (longer buffer, language detection, VAD filter, options that the batch
+    doesn't support). So the transcripts are the same as without batching.
+    """
+
+    # decoding options that are applied to the batches, the calls are batched only with the same values
+    BATCHED_OPTIONS = ("task", "beam_size", "best_of", "patience", "length_penalty", "repetition_penalty",
+                       "no_repeat_ngram_size", "temperature", "compression_ratio_threshold", "log_prob_threshold",
+                       "no_speech_threshold", "suppress_blank", "suppress_tokens", "max_initial_timestamp",
+                       "prepend_punctuations", "append_punctuations", "max_new_tokens")
+    # options that can't be batched when they are not the defaults of WhisperModel.transcribe
+    UNBATCHED_OPTIONS = ("vad_filter", "without_timestamps", "multilingual", "chunk_length", "clip_timestamps",
+                         "hallucination_silence_threshold", "hotwords")
+
+    def __init__(self, asr, window=0.05, max_batch=8):
+        """asr: FasterWhisperASR. Its model should have num_workers > 1, so that the direct calls run in parallel.
+        window: seconds to wait for more calls after the first one of a batch
+        max_batch: maximal number of calls in a batch
+        """
+        self.asr = asr
+        self.model = asr.model
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.batched_calls = 0
+        self.thread = threading.Thread(target=self.run, name="MicroBatchASR", daemon=True)
+        self.thread.start()
+
+    @property
+    def sep(self):
+        return self.asr.sep
+
+    @property
+    def transcribe_kargs(self):
+        return self.asr.transcribe_kargs
+
+    def ts_words(self, segments):
+        return self.asr.ts_words(segments)
+
+    def segments_end_ts(self, res):
+        return self.asr.segments_end_ts(res)
+
+    def use_vad(self):
+        self.asr.use_vad()
+
+    def set_translate_task(self):
+        self.asr.set_translate_task()
+
+    def transcribe(self, audio, init_prompt="", features=None, prefix=None, language=None, **options):
+        segments, info = self.transcribe_stream(audio, init_prompt=init_prompt, features=features, prefix=prefix,
+                                                language=language, **options)
+        return list(segments)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def defaults():
+        """the default options of WhisperModel.transcribe"""
+        from ..transcribe import WhisperModel
+        return {name: p.default for name, p in inspect.signature(WhisperModel.transcribe).parameters.items()
+                if p.default is not inspect.Parameter.empty}
+
+    def transcribe_stream(self, audio, init_prompt="", features=None, prefix=None, language=None, **options):
+        """The same as FasterWhisperASR.transcribe_stream, but the call waits for its batch."""
+        kwargs = dict(beam_size=5, word_timestamps=True, condition_on_previous_text=True)
+        kwargs.update(self.asr.transcribe_kargs)
+        kwargs.update(options)
+        language = language or self.asr.original_language
+        if not self.model.model.is_multilingual:
+            language = "en"
+        defaults = self.defaults()
+        direct = dict(audio=audio, init_prompt=init_prompt, features=features, prefix=prefix, language=language,
+                      **options)
+        if (language is None or not kwargs["word_timestamps"] or len(audio) > self.model.feature_extractor.n_samples
+                or any(kwargs.get(o, defaults[o]) != defaults[o] for o in self.UNBATCHED_OPTIONS)):
+            return self.asr.transcribe_stream(**direct)
+
+        stage_timer = kwargs.get("stage_timer")
+        if features is None:
+            with timed(stage_timer, "features"):
+                features = self.model.feature_extractor(audio)
+        decoding = {o: kwargs.get(o, defaults[o]) for o in self.BATCHED_OPTIONS}
+        if not isinstance(decoding["temperature"], (list, tuple)):
+            decoding["temperature"] = [decoding["temperature"]]
+        key = (language,) + tuple((o, tuple(v) if isinstance(v, list) else v) for o, v in decoding.items())
+        request = dict(key=key, decoding=decoding, features=features, prompt=init_prompt, prefix=prefix,
+                       future=Future())
+        self.requests.put(request)
+        with timed(stage_timer, "batch"):
+            result = request["future"].result()
+        if result is None:
+            # the first temperature failed the thresholds, the ASR repeats the call with the fallback
+            return self.asr.transcribe_stream(**direct)
+        segments, n_tokens, transcription_options = result
+        if stage_timer is not None:
+            stage_timer.count("windows")
+            stage_timer.count("tokens", n_tokens)
+        from ..transcribe import TranscriptionInfo
+        info = TranscriptionInfo(language=language, language_probability=1.0, duration=len(audio) / SAMPLING_RATE,
+                                 duration_after_vad=len(audio) / SAMPLING_RATE, all_language_probs=None,
+                                 transcription_options=replace(transcription_options, initial_prompt=init_prompt,
+                                                               prefix=prefix),
+                                 vad_options=None)
+        return (s for s in segments), info
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)  # stop after this batch
+                    break
+                batch.append(request)
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(request["key"], []).append(request)
+            for key, group in groups.items():
+                try:
+                    results = self.process_batch(group[0]["key"][0], group[0]["decoding"], group)
+                except Exception as e:
+                    for request in group:
+                        request["future"].set_exception(e)
+                    continue
+                for request, result in zip(group, results):
+                    request["future"].set_result(result)
+                self.batches += 1
+                self.batched_calls += len(group)
+                logger.debug(f"batch of {len(group)} calls, {key}")
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    @staticmethod
+    def needs_fallback(decoding, compression_ratio, avg_logprob, no_speech_prob):
+        """whether WhisperModel.generate_with_fallback would decode the window again at the next temperature"""
+        if len(decoding["temperature"]) < 2:
+            return False
+        if decoding["no_speech_threshold"] is not None and no_speech_prob > decoding["no_speech_threshold"] \
+                and decoding["log_prob_threshold"] is not None and avg_logprob < decoding["log_prob_threshold"]:
+            return False  # silence
+        if decoding["compression_ratio_threshold"] is not None \
+                and compression_ratio > decoding["compression_ratio_threshold"]:
+            return True  # too repetitive
+        return decoding["log_prob_threshold"] is not None and avg_logprob < decoding["log_prob_threshold"]
+
+    @staticmethod
+    def no_speech(decoding, avg_logprob, no_speech_prob):
+        """the no speech check of WhisperModel.generate_segments"""
+        if decoding["no_speech_threshold"] is None or no_speech_prob <= decoding["no_speech_threshold"]:
+            return False
+        # don't skip if the logprob is high enough, despite the no_speech_prob
+        return decoding["log_prob_threshold"] is None or avg_logprob <= decoding["log_prob_threshold"]
+
+    def process_batch(self, language, decoding, requests):
+        """Returns the list of (segments, number of generated tokens, TranscriptionOptions) of the requests, or None
+        for a request that needs the temperature fallback."""
+        from ..audio import pad_or_trim
+        from ..tokenizer import Tokenizer
+        from ..transcribe import Segment, TranscriptionOptions, Word, get_compression_ratio, get_suppressed_tokens
+
+        model = self.model
+        tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task=decoding["task"],
+                              language=language)
+        suppress_tokens = decoding["suppress_tokens"]
+        if suppress_tokens:
+            suppress_tokens = get_suppressed_tokens(tokenizer, suppress_tokens)
+        options = TranscriptionOptions(
+            beam_size=decoding["beam_size"], best_of=decoding["best_of"], patience=decoding["patience"],
+            length_penalty=decoding["length_penalty"], repetition_penalty=decoding["repetition_penalty"],
+            no_repeat_ngram_size=decoding["no_repeat_ngram_size"], log_prob_threshold=decoding["log_prob_threshold"],
+            no_speech_threshold=decoding["no_speech_threshold"],
+            compression_ratio_threshold=decoding["compression_ratio_threshold"], condition_on_previous_text=True,
+            prompt_reset_on_temperature=0.5, temperatures=list(decoding["temperature"]), initial_prompt=None,
+            prefix=None, suppress_blank=decoding["suppress_blank"], suppress_tokens=suppress_tokens,
+            without_timestamps=False, max_initial_timestamp=decoding["max_initial_timestamp"], word_timestamps=True,
+            prepend_punctuations=decoding["prepend_punctuations"],
+            append_punctuations=decoding["append_punctuations"], multilingual=False,
+            max_new_tokens=decoding["max_new_tokens"], clip_timestamps="0", hallucination_silence_threshold=None,
+            hotwords=None)
+
+        segment_sizes = []
+        features = []
+        for request in requests:
+            # the same window as in WhisperModel.generate_segments
+            segment_sizes.append(min(model.feature_extractor.nb_max_frames, request["features"].shape[-1] - 1))
+            features.append(pad_or_trim(request["features"][:, :segment_sizes[-1]]))
+        encoder_output = model.encode(np.stack(features))
+
+        prompts = [model.get_prompt(tokenizer, tokenizer.encode(" " + r["prompt"].strip()), prefix=r["prefix"])
+                   for r in requests]
+        max_length = model.max_length
+        if options.max_new_tokens is not None:
+            max_length = min(max_length, max(len(p) for p in prompts) + options.max_new_tokens)
+        temperature = options.temperatures[0]
+        if temperature > 0:
+            sampling = dict(beam_size=1, num_hypotheses=options.best_of, sampling_topk=0,
+                            sampling_temperature=temperature)
+        else:
+            sampling = dict(beam_size=options.beam_size, patience=options.patience)
+        results = model.model.generate(
+            encoder_output,
+            prompts,
+            length_penalty=options.length_penalty,
+            repetition_penalty=options.repetition_penalty,
+            no_repeat_ngram_size=options.no_repeat_ngram_size,
+            max_length=max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=options.suppress_blank,
+            suppress_tokens=options.suppress_tokens,
+            max_initial_timestamp_index=int(round(options.max_initial_timestamp / model.time_precision)),
+            **sampling,
+        )
+
+        outputs = []
+        for result, segment_size in zip(results, segment_sizes):
+            tokens = result.sequences_ids[0]
+            # the same as in WhisperModel.generate_with_fallback
+            avg_logprob = result.scores[0] * (len(tokens) ** options.length_penalty) / (len(tokens) + 1)
+            compression_ratio = get_compression_ratio(tokenizer.decode(tokens).strip())
+            if self.needs_fallback(decoding, compression_ratio, avg_logprob, result.no_speech_prob):
+                outputs.append(None)
+                continue
+            subsegments, _, _ = model._split_segments_by_timestamps(
+                tokenizer=tokenizer,
+                tokens=tokens,
+                time_offset=0.0,
+                segment_size=segment_size,
+                segment_duration=segment_size * model.feature_extractor.time_per_frame,
+                seek=0,
+            )
+            outputs.append((subsegments, tokens, avg_logprob, result.no_speech_prob))
+        # the alignment runs over all the rows of the encoder output, the fallback calls have no segments to align
+        model.add_word_timestamps([[] if o is None else o[0] for o in outputs], tokenizer, encoder_output,
+                                  segment_sizes, options.prepend_punctuations, options.append_punctuations,
+                                  last_speech_timestamp=0.0)
+
+        ret = []
+        for output in outputs:
+            if output is None:
+                ret.append(None)
+                continue
+            subsegments, tokens, avg_logprob, no_speech_prob = output
+            segments = []
+            if not self.no_speech(decoding, avg_logprob, no_speech_prob):
+                for s in subsegments:
+                    text = tokenizer.decode(s["tokens"])
+                    if s["start"] == s["end"] or not text.strip():
+                        continue
+                    segments.append(Segment(
+                        id=len(segments) + 1, seek=0, start=s["start"], end=s["end"], text=text, tokens=s["tokens"],
+                        temperature=temperature, avg_logprob=avg_logprob, compression_ratio=get_compression_ratio(text),
+                        no_speech_prob=no_speech_prob, words=[Word(**w) for w in s["words"]]))
+            ret.append((segments, len(tokens), options))
+        return ret
@@ -1,3 +1,4 @@
 from .FasterWhisperASR import FasterWhisperASR
+from .MicroBatchASR import MicroBatchASR
 
-__all__ = ["FasterWhisperASR"]
\ No newline at end of file
+__all__ = ["FasterWhisperASR", "MicroBatchASR"]
\ No newline at end of file
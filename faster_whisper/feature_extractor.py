@@ -204,12 +204,23 @@ class FeatureExtractor:
             self.n_samples = chunk_length * self.sampling_rate
             self.nb_max_frames = self.n_samples // self.hop_length
 
-        if waveform.dtype is not np.float32:
+        if waveform.dtype != np.float32:
             waveform = waveform.astype(np.float32)
 
         if padding:
             waveform = np.pad(waveform, (0, padding))
 
+        log_spec = self.log_mel_frames(waveform)[:, :-1]
+
+        return self.normalize(log_spec)
+
+    def log_mel_frames(self, waveform: np.ndarray, center: bool = True):
+        """
+        Compute the log-Mel frames of the waveform, without the dynamic range normalization.
+
+        Each frame only depends on the n_fft samples under its window, so frames can be
+        computed piecewise (with center=False) and normalized together afterwards.
+        """
         window = np.hanning(self.n_fft + 1)[:-1].astype("float32")
 
         stft = self.stft(
@@ -217,13 +228,17 @@ class FeatureExtractor:
             self.n_fft,
             self.hop_length,
             window=window,
+            center=center,
             return_complex=True,
         ).astype("complex64")
-        magnitudes = np.abs(stft[..., :-1]) ** 2
+        magnitudes = np.abs(stft) ** 2
 
         mel_spec = self.mel_filters @ magnitudes
 
-        log_spec = np.log10(np.clip(mel_spec, a_min=1e-10, a_max=None))
+        return np.log10(np.clip(mel_spec, a_min=1e-10, a_max=None))
+
+    @staticmethod
+    def normalize(log_spec: np.ndarray):
         log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
         log_spec = (log_spec + 4.0) / 4.0
 
@@ -0,0 +1,155 @@
+import logging
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+
+class Job:
+    '''One offline transcription request: the audio, the options, and the progress and results.
+
+    The worker thread updates the job, and the other threads read it by to_dict(), under the lock of the job.
+    '''
+
+    def __init__(self, audio, options):
+        '''audio: the waveform, or a path or file-like object decoded by decode_audio
+        options: options of BatchedInferencePipeline.transcribe for this job
+        '''
+        self.id = secrets.token_hex(8)
+        self.audio = audio
+        self.options = options
+        self.status = "queued"  # running, done, failed
+        self.error = None
+        self.language = None
+        self.duration = None  # seconds of audio
+        self.segments = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.compute = None  # seconds of decoding and transcribing
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add_segment(self, segment):
+        s = dict(start=segment.start, end=segment.end, text=segment.text)
+        if segment.words:
+            s["words"] = [(w.start, w.end, w.word) for w in segment.words]
+        with self.lock:
+            self.segments.append(s)
+
+    def to_dict(self, since=0):
+        '''Returns the state of the job, with the segments from the index "since" on.'''
+        with self.lock:
+            d = dict(id=self.id, status=self.status, error=self.error, language=self.language,
+                     duration=self.duration, segments=self.segments[since:])
+            if self.started is not None:
+                d["wait"] = self.started - self.submitted
+            if self.compute is not None:
+                d["compute"] = self.compute
+                d["rtf"] = self.compute / self.duration if self.duration else None
+            return d
+
+    def wait(self, timeout=None):
+        '''blocks until the job is done or failed'''
+        return self.done.wait(timeout)
+
+
+class JobQueue:
+    '''Transcribes the submitted jobs by a pool of worker threads. Every worker has its own BatchedInferencePipeline,
+    because the pipeline keeps the state of the transcribed audio, and the pipelines share one WhisperModel.
+
+    Every job is transcribed in batches of its 30 s windows, so the offline traffic uses the batched throughput of
+    the model. `workers` jobs run in parallel, the model should have as many parallel workers. At most `max_queue`
+    jobs wait, submit() raises queue.Full when the queue is full. The last `max_jobs` finished jobs are kept to be
+    read by the clients, the older ones are forgotten.
+    '''
+
+    def __init__(self, pipeline_factory, workers=1, max_queue=16, max_jobs=1000, **transcribe_kargs):
+        '''pipeline_factory: function returning a new BatchedInferencePipeline, or an object with the same
+            transcribe method, e.g. `lambda: BatchedInferencePipeline(model)`. It is called once by every worker.
+        transcribe_kargs: default options of pipeline.transcribe, e.g. language, task, batch_size
+        '''
+        self.pipeline_factory = pipeline_factory
+        self.transcribe_kargs = transcribe_kargs
+        self.max_jobs = max_jobs
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.jobs = OrderedDict()
+        self.finished = deque()  # ids of the finished jobs, the oldest first
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name=f"JobWorker-{i}", daemon=True) for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, audio, **options):
+        '''Queues a new job and returns it. Raises queue.Full if too many jobs are waiting.'''
+        job = Job(audio, options)
+        with self.lock:
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+        logger.debug(f"job {job.id} queued, {self.queue.qsize()} waiting")
+        return job
+
+    def get(self, job_id):
+        '''Returns the job, or None if it is unknown or forgotten.'''
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self):
+        pipeline = self.pipeline_factory()
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self.process(job, pipeline)
+
+    def process(self, job, pipeline):
+        with job.lock:
+            job.status = "running"
+            job.started = time.time()
+        t = time.perf_counter()
+        try:
+            audio = job.audio
+            if not isinstance(audio, np.ndarray):
+                from .audio import decode_audio
+                audio = decode_audio(audio, sampling_rate=SAMPLING_RATE)
+            kwargs = dict(self.transcribe_kargs)
+            kwargs.update(job.options)
+            with job.lock:
+                job.duration = len(audio) / SAMPLING_RATE
+            segments, info = pipeline.transcribe(audio, **kwargs)
+            with job.lock:
+                job.language = info.language
+            for segment in segments:
+                job.add_segment(segment)
+            status, error = "done", None
+        except Exception as e:
+            logger.exception(f"job {job.id} failed")
+            status, error = "failed", str(e)
+        with job.lock:
+            job.compute = time.perf_counter() - t
+            job.finished = time.time()
+            job.status = status
+            job.error = error
+            job.audio = None
+        job.done.set()
+        logger.debug(f"job {job.id} {status}, compute {job.compute:.2f} s, audio {job.duration} s")
+        self.retire(job)
+
+    def retire(self, job):
+        with self.lock:
+            self.finished.append(job.id)
+            while len(self.finished) > self.max_jobs:
+                self.jobs.pop(self.finished.popleft(), None)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
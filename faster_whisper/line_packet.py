@@ -11,12 +11,15 @@ containing:
 
 Originally from the UEDIN team of the ELITR project. 
 """
-import io
-import soundfile
+import os
+import secrets
 import sys
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
 import logging
-import librosa
+from .ASRProcessor.AudioBuffer import AudioBuffer
 
 PACKET_SIZE = 65536
 SAMPLING_RATE = 16000
@@ -104,6 +107,45 @@ def receive_lines(socket):
 
 
 
+class PCM16Decoder:
+    '''Converts the received raw bytes of 16 kHz mono s16le PCM to float32 audio.
+
+    The samples are read from the received bytes by np.frombuffer without copying, and converted straight into a
+    preallocated float32 buffer. A read can end in the middle of a sample, then its first byte is carried over to
+    the next read.
+    '''
+
+    def __init__(self, capacity=SAMPLING_RATE * 60):
+        self.audio = AudioBuffer(capacity=capacity)
+        self.carry = None  # the first byte of an incomplete sample
+
+    def __len__(self):
+        return len(self.audio)
+
+    def feed(self, raw_bytes):
+        data = memoryview(raw_bytes)
+        if self.carry is not None and len(data):
+            self.append(np.frombuffer(self.carry + data[:1].tobytes(), dtype="<i2"))
+            data = data[1:]
+            self.carry = None
+        n = len(data) // 2 * 2
+        if n < len(data):
+            self.carry = data[n:].tobytes()
+        self.append(np.frombuffer(data[:n], dtype="<i2"))
+
+    def append(self, samples):
+        if len(samples) == 0:
+            return
+        self.audio.append(samples)
+        self.audio.view()[-len(samples):] *= 1 / 32768
+
+    def take(self):
+        """Returns the decoded audio and starts a new chunk. The returned array is not modified afterwards."""
+        audio = self.audio.view()
+        self.audio.clear()
+        return audio
+
+
 class Connection:
     '''it wraps conn object'''
     PACKET_SIZE = 32000*5*60 # 5 minutes # was: 65536
@@ -125,6 +167,16 @@ class Connection:
         in_line = receive_lines(self.conn)
         return in_line
 
+    def receive_header(self, limit=256):
+        '''receives a short line of text that precedes the audio, byte by byte, so that no audio is consumed'''
+        data = b''
+        while len(data) < limit:
+            byte = self.conn.recv(1)
+            if not byte or byte == b'\n':
+                break
+            data += byte
+        return data.decode('utf-8', errors='replace').strip()
+
     def non_blocking_receive_audio(self):
         try:
             r = self.conn.recv(self.PACKET_SIZE)
@@ -133,16 +185,68 @@ class Connection:
             return None
 
 
+class SessionStore:
+    '''In-memory store of the states of interrupted streams, by session token.
+
+    A reconnecting client continues its stream from the stored state instead of sending and transcribing the audio
+    again. The least recently stored sessions are dropped when there are more than max_sessions of them, and the
+    sessions stored more than ttl seconds ago are expired.
+    '''
+
+    def __init__(self, max_sessions=100, ttl=600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()  # token -> (time stored, state)
+        self.lock = threading.Lock()
+
+    def new_token(self):
+        return secrets.token_hex(16)
+
+    def put(self, token, state):
+        with self.lock:
+            self.sessions.pop(token, None)
+            self.sessions[token] = (time.monotonic(), state)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def pop(self, token):
+        '''Returns the state of the session and removes it from the store, or None if it is unknown or expired.'''
+        with self.lock:
+            now = time.monotonic()
+            while self.sessions and now - next(iter(self.sessions.values()))[0] > self.ttl:
+                self.sessions.popitem(last=False)
+            stored = self.sessions.pop(token, None)
+        return None if stored is None else stored[1]
+
+
+def interim_delta(previous, text):
+    '''Returns (keep, suffix): text is the first keep characters of previous, followed by suffix.'''
+    keep = len(os.path.commonprefix([previous, text]))
+    return keep, text[keep:]
+
+
 # wraps socket and ASR object, and serves one client connection.
 # next client should be served by a new instance of this object
+#
+# With interim=True, the uncommitted tail of the transcript is sent too, after the committed line of every iteration,
+# if it changed. An interim line is "* <keep> <text>": the new interim text is the first <keep> characters of the
+# previous one, followed by <text>. It replaces the previous interim text, which starts empty.
+#
+# With a SessionStore, the client starts the connection with a line of its session token, or an empty line for a new
+# session, and then the audio. The server answers "session <token>". When the connection ends, the state of the stream
+# is stored, and a client that reconnects with the token continues it.
 class ServerProcessor:
 
-    def __init__(self, c, online_asr_proc, min_chunk):
+    def __init__(self, c, online_asr_proc, min_chunk, interim=False, sessions=None):
         self.connection = c
         self.online_asr_proc = online_asr_proc
         self.min_chunk = min_chunk
+        self.interim = interim
+        self.sessions = sessions
 
         self.last_end = None
+        self.last_interim = ""
+        self.pcm = PCM16Decoder()
 
         self.is_first = True
 
@@ -150,25 +254,19 @@ class ServerProcessor:
         # receive all audio that is available by this time
         # blocks operation if less than self.min_chunk seconds is available
         # unblocks if connection is closed or a chunk is available
-        out = []
         minlimit = self.min_chunk*SAMPLING_RATE
-        while sum(len(x) for x in out) < minlimit:
+        while len(self.pcm) < minlimit:
             raw_bytes = self.connection.non_blocking_receive_audio()
             if not raw_bytes:
                 break
 #            print("received audio:",len(raw_bytes), "bytes", raw_bytes[:10])
-            sf = soundfile.SoundFile(io.BytesIO(raw_bytes), channels=1,
-                                     endian="LITTLE",samplerate=SAMPLING_RATE,
-                                     subtype="PCM_16",format="RAW")
-            audio, _ = librosa.load(sf,sr=SAMPLING_RATE,dtype=np.float32)
-            out.append(audio)
-        if not out:
+            self.pcm.feed(raw_bytes)
+        if len(self.pcm) == 0:
             return None
-        conc = np.concatenate(out)
-        if self.is_first and len(conc) < minlimit:
+        if self.is_first and len(self.pcm) < minlimit:
             return None
         self.is_first = False
-        return np.concatenate(out)
+        return self.pcm.take()
 
     def format_output_transcript(self,o):
         # output format in stdout is like:
@@ -199,9 +297,42 @@ class ServerProcessor:
         if msg is not None:
             self.connection.send(msg)
 
+    def send_interim(self, o):
+        text = o[2].strip()
+        if text == self.last_interim:
+            return
+        keep, suffix = interim_delta(self.last_interim, text)
+        self.last_interim = text
+        self.connection.send("* %d %s" % (keep, suffix))
+
+    def start_session(self, token):
+        # token: received from the client, empty for a new session
+        # returns the session token, and restores the state of a known session
+        state = self.sessions.pop(token) if token else None
+        if state is None:
+            if token:
+                logger.info("unknown or expired session, starting a new one")
+            token = self.sessions.new_token()
+            self.online_asr_proc.init()
+        else:
+            logger.info("continuing the session")
+            self.online_asr_proc.restore(state["online"])
+            self.last_end = state["last_end"]
+            self.last_interim = state["last_interim"]
+            self.is_first = False
+        self.connection.send("session %s" % token)
+        return token
+
+    def store_session(self, token):
+        self.sessions.put(token, dict(online=self.online_asr_proc.snapshot(), last_end=self.last_end,
+                                      last_interim=self.last_interim))
+
     def process(self):
         # handle one client connection
-        self.online_asr_proc.init()
+        if self.sessions is not None:
+            token = self.start_session(self.connection.receive_header())
+        else:
+            self.online_asr_proc.init()
         while True:
             a = self.receive_audio_chunk()
             if a is None:
@@ -210,9 +341,13 @@ class ServerProcessor:
             o = self.online_asr_proc.process_iter()
             try:
                 self.send_result(o)
+                if self.interim:
+                    self.send_interim(self.online_asr_proc.interim)
             except BrokenPipeError:
                 logger.info("broken pipe -- connection closed?")
                 break
+        if self.sessions is not None:
+            self.store_session(token)
 
 #        o = online.finish()  # this should be working
 #        self.send_result(o)
\ No newline at end of file
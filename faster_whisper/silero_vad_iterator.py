@@ -1,8 +1,8 @@
-import torch
+import numpy as np
 
 # This is copied from silero-vad's vad_utils.py:
 # https://github.com/snakers4/silero-vad/blob/94811cbe1207ec24bc0f5370b895364b8934936f/src/silero_vad/utils_vad.py#L398C1-L489C20
-# (except changed defaults)
+# (except changed defaults, and that it runs the bundled ONNX model by StreamingSileroVAD instead of torch)
 
 # Their licence is MIT, same as ours: https://github.com/snakers4/silero-vad/blob/94811cbe1207ec24bc0f5370b895364b8934936f/LICENSE
 
@@ -20,14 +20,14 @@ class VADIterator:
 
         Parameters
         ----------
-        model: preloaded .jit/.onnx silero VAD model
+        model: faster_whisper.vad.StreamingSileroVAD, stateful streaming wrapper of the bundled silero ONNX model
 
         threshold: float (default - 0.5)
             Speech threshold. Silero VAD outputs speech probabilities for each audio chunk, probabilities ABOVE this value are considered as SPEECH.
             It is better to tune this parameter for each dataset separately, but "lazy" 0.5 is pretty good for most datasets.
 
         sampling_rate: int (default - 16000)
-            Currently silero VAD models support 8000 and 16000 sample rates
+            The bundled ONNX model supports only 16000 sample rate
 
         min_silence_duration_ms: int (default - 100 milliseconds)
             In the end of each speech chunk wait for min_silence_duration_ms before separating it
@@ -40,8 +40,8 @@ class VADIterator:
         self.threshold = threshold
         self.sampling_rate = sampling_rate
 
-        if sampling_rate not in [8000, 16000]:
-            raise ValueError('VADIterator does not support sampling rates other than [8000, 16000]')
+        if sampling_rate != 16000:
+            raise ValueError('VADIterator does not support sampling rates other than 16000')
 
         self.min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
         self.speech_pad_samples = sampling_rate * speech_pad_ms / 1000
@@ -54,11 +54,21 @@ class VADIterator:
         self.temp_end = 0
         self.current_sample = 0
 
-    @torch.no_grad()
+    def snapshot(self):
+        """Returns a copy of the iterator and model state, to be continued by restore()."""
+        return dict(triggered=self.triggered, temp_end=self.temp_end, current_sample=self.current_sample,
+                    model=self.model.snapshot())
+
+    def restore(self, state):
+        self.model.restore(state["model"])
+        self.triggered = state["triggered"]
+        self.temp_end = state["temp_end"]
+        self.current_sample = state["current_sample"]
+
     def __call__(self, x, return_seconds=False, time_resolution: int = 1):
         """
-        x: torch.Tensor
-            audio chunk (see examples in repo)
+        x: np.ndarray
+            audio chunk of 512 samples
 
         return_seconds: bool (default - False)
             whether return timestamps in seconds (default - samples)
@@ -67,16 +77,11 @@ class VADIterator:
             time resolution of speech coordinates when requested as seconds
         """
 
-        if not torch.is_tensor(x):
-            try:
-                x = torch.Tensor(x)
-            except:
-                raise TypeError("Audio cannot be casted to tensor. Cast it manually")
-
-        window_size_samples = len(x[0]) if x.dim() == 2 else len(x)
+        x = np.asarray(x, dtype=np.float32)
+        window_size_samples = len(x)
         self.current_sample += window_size_samples
 
-        speech_prob = self.model(x, self.sampling_rate).item()
+        speech_prob = float(self.model(x)[0])
 
         if (speech_prob >= self.threshold) and self.temp_end:
             self.temp_end = 0
@@ -102,26 +107,42 @@ class VADIterator:
 #######################
 # because Silero now requires exactly 512-sized audio chunks 
 
-import numpy as np
 class FixedVADIterator(VADIterator):
     '''It fixes VADIterator by allowing to process any audio length, not only exactly 512 frames at once.
     If audio to be processed at once is long and multiple voiced segments detected, 
     then __call__ returns the start of the first segment, and end (or middle, which means no end) of the last segment. 
+
+    All the complete 512-sample windows of a call are evaluated by the model at once, the model carries its state
+    between them. Then the same start/end decisions as in VADIterator are made, but only the windows where the state
+    can change are visited.
     '''
 
+    window_size_samples = 512
+
     def reset_states(self):
         super().reset_states()
-        self.buffer = np.array([],dtype=np.float32)
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    def snapshot(self):
+        return dict(super().snapshot(), buffer=self.buffer.copy())
+
+    def restore(self, state):
+        super().restore(state)
+        self.buffer = state["buffer"].copy()
 
     def __call__(self, x, return_seconds=False):
-        self.buffer = np.append(self.buffer, x) 
+        buffer = np.concatenate([self.buffer, np.asarray(x, dtype=np.float32)])
+        n = len(buffer) - len(buffer) % self.window_size_samples
+        self.buffer = buffer[n:].copy()
+        if n == 0:
+            return None
+        speech_probs = self.model(buffer[:n])
+
         ret = None
-        while len(self.buffer) >= 512:
-            r = super().__call__(self.buffer[:512], return_seconds=return_seconds)
-            self.buffer = self.buffer[512:]
+        for r in self.events(speech_probs, return_seconds):
             if ret is None:
                 ret = r
-            elif r is not None:
+            else:
                 if 'end' in r:
                     ret['end'] = r['end']  # the latter end
                 if 'start' in r and 'end' in ret:  # there is an earlier start.
@@ -129,22 +150,71 @@ class FixedVADIterator(VADIterator):
                     del ret['end']
         return ret if ret != {} else None
 
+    def events(self, speech_probs, return_seconds=False):
+        """Yields the start and end events of the consecutive windows with speech_probs, the same as VADIterator
+        called on each of them, and updates the state.
+        """
+        window = self.window_size_samples
+        speech = np.flatnonzero(speech_probs >= self.threshold)
+        silence = np.flatnonzero(speech_probs < self.threshold - 0.15)
+        n = len(speech_probs)
+        base = self.current_sample
+        self.current_sample += n * window
+
+        def timestamp(sample):
+            return int(sample) if not return_seconds else round(sample / self.sampling_rate, 1)
+
+        i = 0  # the next window to process
+        while i < n:
+            if not self.triggered:
+                k = np.searchsorted(speech, i)
+                if k == len(speech):
+                    return
+                i = speech[k]
+                self.triggered = True
+                speech_start = max(0, base + (i + 1) * window - self.speech_pad_samples - window)
+                yield {'start': timestamp(speech_start)}
+                i += 1
+                continue
+
+            # triggered: find the silence window that starts the possible end, unless there is one already
+            if not self.temp_end:
+                k = np.searchsorted(silence, i)
+                if k == len(silence):
+                    return
+                i = silence[k]
+                self.temp_end = base + (i + 1) * window
+            # the speech window that cancels the possible end
+            k = np.searchsorted(speech, i)
+            cancel = speech[k] if k < len(speech) else n
+            # the first silence window before it that is long enough after temp_end
+            first = max(i, int(np.ceil((self.temp_end + self.min_silence_samples - base) / window)) - 1)
+            k = np.searchsorted(silence, first)
+            if k < len(silence) and silence[k] < cancel:
+                i = silence[k]
+                speech_end = self.temp_end + self.speech_pad_samples - window
+                self.temp_end = 0
+                self.triggered = False
+                yield {'end': timestamp(speech_end)}
+                i += 1
+            elif cancel < n:
+                self.temp_end = 0
+                i = cancel + 1
+            else:
+                return
+
 if __name__ == "__main__":
     # test/demonstrate the need for FixedVADIterator:
 
-    import torch
-    model, _ = torch.hub.load(
-        repo_or_dir='snakers4/silero-vad',
-        model='silero_vad'
-    )
-    vac = FixedVADIterator(model)
+    from faster_whisper.vad import StreamingSileroVAD
+    vac = FixedVADIterator(StreamingSileroVAD())
 #   vac = VADIterator(model)  # the second case crashes with this
 
     # this works: for both
     audio_buffer = np.array([0]*(512),dtype=np.float32)
     vac(audio_buffer)
 
-    # this crashes on the non FixedVADIterator with 
-    # ops.prim.RaiseException("Input audio chunk is too short", "builtins.ValueError")
+    # this crashes on the non FixedVADIterator with
+    # AssertionError: Input size should be a multiple of num_samples
     audio_buffer = np.array([0]*(512-1),dtype=np.float32)
     vac(audio_buffer)
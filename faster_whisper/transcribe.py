@@ -15,7 +15,14 @@ import tokenizers
 from .audio import decode_audio, pad_or_trim
 from .feature_extractor import FeatureExtractor
 from .tokenizer import _LANGUAGE_CODES, Tokenizer
-from .utils import download_model, format_timestamp, get_end, get_logger
+from .utils import (
+    StageTimer,
+    download_model,
+    format_timestamp,
+    get_end,
+    get_logger,
+    timed,
+)
 from .vad import (
     SpeechTimestampsMap,
     VadOptions,
@@ -293,6 +300,9 @@ class BatchedInferencePipeline:
         hotwords: Optional[str] = None,
         language_detection_threshold: Optional[float] = 0.5,
         language_detection_segments: int = 1,
+        features: Optional[np.ndarray] = None,
+        stage_timer: Optional[StageTimer] = None,
+        vad_speech_probs: Optional[np.ndarray] = None,
     ) -> Tuple[Iterable[Segment], TranscriptionInfo]:
         """transcribe audio in chunks in batched fashion and return with language info.
 
@@ -364,6 +374,11 @@ class BatchedInferencePipeline:
             hallucination_silence_threshold: Optional[float]
                 When word_timestamps is True, skip silent periods longer than this threshold
                 (in seconds) when a possible hallucination is detected. set as None.
+            features: Precomputed features of the whole audio, not used. The features are
+                computed for each chunk.
+            stage_timer: Not used.
+            vad_speech_probs: Optional precomputed speech probabilities of the 512-sample
+                windows of the audio, used by the VAD instead of running the model.
         Returns:
           A tuple with:
 
@@ -405,7 +420,9 @@ class BatchedInferencePipeline:
                         **vad_parameters, max_speech_duration_s=chunk_length
                     )
 
-                clip_timestamps = get_speech_timestamps(audio, vad_parameters)
+                clip_timestamps = get_speech_timestamps(
+                    audio, vad_parameters, speech_probs=vad_speech_probs
+                )
             # run the audio if it is less than 30 sec even without clip_timestamps
             elif duration < chunk_length:
                 clip_timestamps = [{"start": 0, "end": audio.shape[0]}]
@@ -785,6 +802,9 @@ class WhisperModel:
         hotwords: Optional[str] = None,
         language_detection_threshold: Optional[float] = 0.5,
         language_detection_segments: int = 1,
+        features: Optional[np.ndarray] = None,
+        stage_timer: Optional[StageTimer] = None,
+        vad_speech_probs: Optional[np.ndarray] = None,
     ) -> Tuple[Iterable[Segment], TranscriptionInfo]:
         """Transcribes an input file.
 
@@ -854,6 +874,15 @@ class WhisperModel:
           language_detection_threshold: If the maximum probability of the language tokens is higher
            than this value, the language is detected.
           language_detection_segments: Number of segments to consider for the language detection.
+          features: Optional log-Mel features of the audio waveform, precomputed by the feature
+            extractor (e.g. incrementally, when streaming). They are recomputed if the VAD filter
+            removes part of the audio.
+          stage_timer: Optional StageTimer that accumulates the durations of the processing
+            stages (vad, features, language_detection, encode, decode, align) and the counters
+            of windows, generated tokens and temperature fallbacks.
+          vad_speech_probs: Optional precomputed speech probabilities of the 512-sample windows
+            of the audio, used by the VAD filter instead of running the model, e.g. when they
+            are computed incrementally by a streaming VAD.
         Returns:
           A tuple with:
 
@@ -884,9 +913,12 @@ class WhisperModel:
                 vad_parameters = VadOptions()
             elif isinstance(vad_parameters, dict):
                 vad_parameters = VadOptions(**vad_parameters)
-            speech_chunks = get_speech_timestamps(audio, vad_parameters)
-            audio_chunks, chunks_metadata = collect_chunks(audio, speech_chunks)
-            audio = np.concatenate(audio_chunks, axis=0)
+            with timed(stage_timer, "vad"):
+                speech_chunks = get_speech_timestamps(
+                    audio, vad_parameters, speech_probs=vad_speech_probs
+                )
+                audio_chunks, chunks_metadata = collect_chunks(audio, speech_chunks)
+                audio = np.concatenate(audio_chunks, axis=0)
             duration_after_vad = audio.shape[0] / sampling_rate
 
             self.logger.info(
@@ -910,7 +942,9 @@ class WhisperModel:
         else:
             speech_chunks = None
 
-        features = self.feature_extractor(audio, chunk_length=chunk_length)
+        if features is None or speech_chunks is not None:
+            with timed(stage_timer, "features"):
+                features = self.feature_extractor(audio, chunk_length=chunk_length)
 
         encoder_output = None
         all_language_probs = None
@@ -932,15 +966,16 @@ class WhisperModel:
                     if start_timestamp * self.frames_per_second < content_frames
                     else 0
                 )
-                (
-                    language,
-                    language_probability,
-                    all_language_probs,
-                ) = self.detect_language(
-                    features=features[..., seek:],
-                    language_detection_segments=language_detection_segments,
-                    language_detection_threshold=language_detection_threshold,
-                )
+                with timed(stage_timer, "language_detection"):
+                    (
+                        language,
+                        language_probability,
+                        all_language_probs,
+                    ) = self.detect_language(
+                        features=features[..., seek:],
+                        language_detection_segments=language_detection_segments,
+                        language_detection_threshold=language_detection_threshold,
+                    )
 
                 self.logger.info(
                     "Detected language '%s' with probability %.2f",
@@ -1000,7 +1035,7 @@ class WhisperModel:
         )
 
         segments = self.generate_segments(
-            features, tokenizer, options, log_progress, encoder_output
+            features, tokenizer, options, log_progress, encoder_output, stage_timer
         )
 
         if speech_chunks:
@@ -1104,6 +1139,7 @@ class WhisperModel:
         options: TranscriptionOptions,
         log_progress,
         encoder_output: Optional[ctranslate2.StorageView] = None,
+        stage_timer: Optional[StageTimer] = None,
     ) -> Iterable[Segment]:
         content_frames = features.shape[-1] - 1
         content_duration = float(content_frames * self.feature_extractor.time_per_frame)
@@ -1184,7 +1220,8 @@ class WhisperModel:
             previous_tokens = all_tokens[prompt_reset_since:]
 
             if seek > 0 or encoder_output is None:
-                encoder_output = self.encode(segment)
+                with timed(stage_timer, "encode"):
+                    encoder_output = self.encode(segment)
 
             if options.multilingual:
                 results = self.model.detect_language(encoder_output)
@@ -1202,12 +1239,15 @@ class WhisperModel:
                 hotwords=options.hotwords,
             )
 
-            (
-                result,
-                avg_logprob,
-                temperature,
-                compression_ratio,
-            ) = self.generate_with_fallback(encoder_output, prompt, tokenizer, options)
+            with timed(stage_timer, "decode"):
+                (
+                    result,
+                    avg_logprob,
+                    temperature,
+                    compression_ratio,
+                ) = self.generate_with_fallback(
+                    encoder_output, prompt, tokenizer, options, stage_timer
+                )
 
             if options.no_speech_threshold is not None:
                 # no voice activity check
@@ -1232,6 +1272,9 @@ class WhisperModel:
                     continue
 
             tokens = result.sequences_ids[0]
+            if stage_timer is not None:
+                stage_timer.count("windows")
+                stage_timer.count("tokens", len(tokens))
 
             previous_seek = seek
 
@@ -1273,15 +1316,16 @@ class WhisperModel:
             )
 
             if options.word_timestamps:
-                self.add_word_timestamps(
-                    [current_segments],
-                    tokenizer,
-                    encoder_output,
-                    segment_size,
-                    options.prepend_punctuations,
-                    options.append_punctuations,
-                    last_speech_timestamp=last_speech_timestamp,
-                )
+                with timed(stage_timer, "align"):
+                    self.add_word_timestamps(
+                        [current_segments],
+                        tokenizer,
+                        encoder_output,
+                        segment_size,
+                        options.prepend_punctuations,
+                        options.append_punctuations,
+                        last_speech_timestamp=last_speech_timestamp,
+                    )
                 if not single_timestamp_ending:
                     last_word_end = get_end(current_segments)
                     if last_word_end is not None and last_word_end > time_offset:
@@ -1402,6 +1446,7 @@ class WhisperModel:
         prompt: List[int],
         tokenizer: Tokenizer,
         options: TranscriptionOptions,
+        stage_timer: Optional[StageTimer] = None,
     ) -> Tuple[ctranslate2.models.WhisperGenerationResult, float, float, float]:
         decode_result = None
         all_results = []
@@ -1511,6 +1556,8 @@ class WhisperModel:
 
             if not needs_fallback:
                 break
+            if stage_timer is not None:
+                stage_timer.count("fallbacks")
         else:
             # all failed, select the result with the highest average log probability
             decode_result = max(
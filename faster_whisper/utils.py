@@ -1,7 +1,9 @@
 import logging
 import os
 import re
-from typing import List, Optional, Union
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Union
 
 import huggingface_hub
 from tqdm.auto import tqdm
@@ -147,3 +149,32 @@ def get_end(segments: List[dict]) -> Optional[float]:
         (w["end"] for s in reversed(segments) for w in reversed(s["words"])),
         segments[-1]["end"] if segments else None,
     )
+
+
+class StageTimer:
+    """Accumulates the wall-clock durations and the counters of named processing stages."""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        self.durations.clear()
+        self.counters.clear()
+
+
+def timed(timer: Optional[StageTimer], name: str):
+    """Returns the context manager timing the stage, or a no-op one if timer is None."""
+    return timer.stage(name) if timer is not None else nullcontext()
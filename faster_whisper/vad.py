@@ -50,6 +50,7 @@ def get_speech_timestamps(
     audio: np.ndarray,
     vad_options: Optional[VadOptions] = None,
     sampling_rate: int = 16000,
+    speech_probs: Optional[np.ndarray] = None,
     **kwargs,
 ) -> List[dict]:
     """This method is used for splitting long audios into speech chunks using silero VAD.
@@ -58,6 +59,9 @@ def get_speech_timestamps(
       audio: One dimensional float array.
       vad_options: Options for VAD processing.
       sampling rate: Sampling rate of the audio.
+      speech_probs: Optional precomputed speech probabilities of the 512-sample windows of
+        audio, e.g. from a streaming VAD. The model is then not run. The missing windows at
+        the end get the probability of the last given window.
       kwargs: VAD options passed as keyword arguments for backward compatibility.
 
     Returns:
@@ -88,12 +92,21 @@ def get_speech_timestamps(
 
     audio_length_samples = len(audio)
 
-    model = get_vad_model()
-
     padded_audio = np.pad(
         audio, (0, window_size_samples - audio.shape[0] % window_size_samples)
     )
-    speech_probs = model(padded_audio)
+    num_windows = padded_audio.shape[0] // window_size_samples
+    if speech_probs is None:
+        model = get_vad_model()
+        speech_probs = model(padded_audio)
+    elif len(speech_probs) == 0:
+        speech_probs = np.zeros(num_windows, dtype=np.float32)
+    else:
+        speech_probs = np.pad(
+            speech_probs[:num_windows],
+            (0, max(0, num_windows - len(speech_probs))),
+            mode="edge",
+        )
 
     triggered = False
     speeches = []
@@ -381,3 +394,80 @@ class SileroVADModel:
         out = np.concatenate(outputs, axis=0)
 
         return out
+
+
+class StreamingSileroVAD:
+    """Stateful wrapper of the Silero VAD model for streaming.
+
+    It keeps the LSTM state and the audio context of the last window between the calls, so
+    that the audio can be passed in consecutive parts. The speech probabilities are the same
+    as if the whole audio was passed to SileroVADModel at once.
+    """
+
+    def __init__(
+        self,
+        model: Optional[SileroVADModel] = None,
+        num_samples: int = 512,
+        context_size_samples: int = 64,
+    ):
+        """Initializes the streaming VAD.
+
+        Args:
+          model: SileroVADModel instance. The bundled model is used if not set.
+          num_samples: Number of samples in a VAD window.
+          context_size_samples: Number of samples of the previous window prepended to a window.
+        """
+        self.model = model if model is not None else get_vad_model()
+        self.num_samples = num_samples
+        self.context_size_samples = context_size_samples
+        self.reset_states()
+
+    def reset_states(self):
+        self.h = np.zeros((1, 1, 128), dtype="float32")
+        self.c = np.zeros((1, 1, 128), dtype="float32")
+        self.context = np.zeros(self.context_size_samples, dtype="float32")
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the streaming state, to be continued by restore()."""
+        return {"h": self.h.copy(), "c": self.c.copy(), "context": self.context.copy()}
+
+    def restore(self, state: dict):
+        """Continues the stream from a state returned by snapshot()."""
+        self.h = state["h"].copy()
+        self.c = state["c"].copy()
+        self.context = state["context"].copy()
+
+    def __call__(self, audio: np.ndarray) -> np.ndarray:
+        """Returns the speech probabilities of the windows of audio.
+
+        Args:
+          audio: One dimensional float array, its length must be a multiple of num_samples.
+
+        Returns:
+          Array of the speech probabilities, one per window.
+        """
+        assert audio.ndim == 1, "Input should be a 1D array"
+        assert (
+            audio.shape[0] % self.num_samples == 0
+        ), "Input size should be a multiple of num_samples"
+        if audio.shape[0] == 0:
+            return np.zeros(0, dtype="float32")
+
+        windows = audio.astype("float32", copy=False).reshape(-1, self.num_samples)
+        context = np.concatenate(
+            [
+                self.context[None],
+                windows[:-1, -self.context_size_samples :],
+            ]
+        )
+        self.context = windows[-1, -self.context_size_samples :].copy()
+
+        output, self.h, self.c = self.model.session.run(
+            None,
+            {
+                "input": np.concatenate([context, windows], 1),
+                "h": self.h,
+                "c": self.c,
+            },
+        )
+        return output
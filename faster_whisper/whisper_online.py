@@ -50,18 +50,54 @@ def add_shared_args(parser):
                         choices=["faster-whisper", "whisper_timestamped", "mlx-whisper", "openai-api"],
                         help='Load only this backend for Whisper processing.')
     parser.add_argument('--vac', action="store_true", default=False, # todo true
-                        help='Use VAC = voice activity controller. Recommended. Requires torch.')
+                        help='Use VAC = voice activity controller. Recommended. It runs the bundled Silero VAD ONNX model.')
+    parser.add_argument('--vac-thread', action="store_true", default=False,
+                        help='Run the VAC voice detection on its own thread, so that it continues during the Whisper decoding and the end of an utterance is processed without waiting for VAD.')
+    parser.add_argument('--vac-pipelined-finish', action="store_true", default=False,
+                        help='Finalize a finished utterance in the background (decoding its last audio), while the next utterance is already processed. The outputs stay in order. The model is loaded with at least 2 parallel workers, so that the two decodes run at the same time.')
     parser.add_argument('--vac-chunk-size', type=float, default=0.04, help='VAC sample size in seconds.')
     parser.add_argument('--vad', action="store_true", default=False,
                         help='Use VAD = voice activity detection, with the default parameters.')
+    parser.add_argument('--vad-gate', action="store_true", default=False,
+                        help='Score the new audio by the bundled Silero VAD, and skip the Whisper call of the iterations in which nothing new is voiced and everything is committed. It is ignored with --vac, which transcribes only the voiced audio already.')
+    parser.add_argument('--vad-cache', action="store_true", default=False,
+                        help='With --vad: compute the speech probabilities of the VAD filter incrementally, only for the newly received audio, instead of the whole buffer in every iteration.')
+    parser.add_argument('--excise-silence', type=float, default=None,
+                        help='Cut the non-speech spans longer than this many seconds out of the audio buffer before transcription, as detected by the bundled Silero VAD, so that more speech fits into a 30 s window. The timestamps are mapped back. Default: off.')
     parser.add_argument('--buffer_trimming', type=str, default="segment", choices=["sentence", "segment"],
-                        help='Buffer trimming strategy -- trim completed sentences marked with punctuation mark and detected by sentence segmenter, or the completed segments returned by Whisper. Sentence segmenter must be installed for "sentence" option.')
+                        help='Buffer trimming strategy -- trim completed sentences marked with punctuation mark and detected by sentence segmenter, or the completed segments returned by Whisper. The "sentence" option uses the built-in punctuation-based sentence segmenter (Latin and CJK marks).')
     parser.add_argument('--buffer_trimming_sec', type=float, default=15,
                         help='Buffer trimming length threshold in seconds. If buffer length is longer, trimming sentence/segment is triggered.')
+    parser.add_argument('--max-buffer-sec', type=float, default=None,
+                        help='Hard limit of the audio buffer length in seconds. If the buffer trimming leaves it longer, it is trimmed at the last committed word. Default: no limit.')
+    parser.add_argument('--feature-cache', action="store_true", default=False,
+                        help='Compute the log-Mel features of the audio buffer incrementally, only for the newly received audio, instead of the whole buffer in every iteration.')
+    parser.add_argument('--committed-prefix', action="store_true", default=False,
+                        help='Force the already committed text inside the audio buffer as the decoder prefix, so that only the uncommitted tail is decoded.')
+    parser.add_argument('--early-stop', action="store_true", default=False,
+                        help='When the audio buffer is longer than one 30 s window, stop decoding it once the commit of the iteration is settled. Not suitable for --offline.')
+    parser.add_argument('--adaptive-decoding', action="store_true", default=False,
+                        help='When the processing gets close to falling behind real time, lower the beam size, disable the temperature fallback and limit the decoded tokens, and restore them when there is headroom.')
+    parser.add_argument('--language-lock', type=int, default=0,
+                        help="With --lan auto, lock the language after this many confident detections in a row, and pass it to the following transcribe calls instead of detecting it every time. 0 disables the lock.")
+    parser.add_argument('--language-recheck', type=float, default=None,
+                        help="Re-check the locked language once per this many seconds of audio. Default: never.")
+    parser.add_argument('--language-recheck-utterance', action="store_true", default=False,
+                        help="Re-check the locked language at the start of every utterance detected by --vac.")
+    parser.add_argument('--stage-timing', action="store_true", default=False,
+                        help="Log the durations of the processing stages (features, encoder, decoder, alignment, ...), the number of generated tokens and temperature fallbacks, and the delay of the committed words, in every iteration.")
     parser.add_argument("-l", "--log-level", dest="log_level",
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the log level",
                         default='DEBUG')
 
+def log_iteration_timing(record):
+    """on_iteration hook of OnlineASRProcessor that logs the timing record of the iteration"""
+    stages = " ".join(f"{name}={t * 1000:.0f}ms" for name, t in record["stages"].items())
+    delay = record["commit_delay"]
+    delay = "-" if delay is None else f"{delay:.2f}s"
+    logger.info(f"iteration at {record['time']:.2f}s: buffer {record['buffer']:.2f}s, total {record['total'] * 1000:.0f}ms, "
+                f"{stages}, tokens={record['tokens']} fallbacks={record['fallbacks']}, commit delay {delay}")
+
 def asr_factory(args, logfile=sys.stderr):
     """
     Creates and configures an ASR and ASR Online instance based on the specified backend and arguments.
@@ -76,7 +112,12 @@ def asr_factory(args, logfile=sys.stderr):
         size = args.model
         t = time.time()
         logger.info(f"Loading Whisper {size} model for {args.lan}...")
-        asr = FasterWhisperASR(lan=args.lan, modelsize=size, cache_dir=args.model_cache_dir, model_dir=args.model_dir)
+        num_workers = getattr(args, 'asr_workers', 1)
+        if args.vac and getattr(args, 'vac_pipelined_finish', False):
+            # the finalizer decodes in parallel with the next utterance, not queued behind it in the model
+            num_workers = max(num_workers, 2)
+        asr = FasterWhisperASR(lan=args.lan, modelsize=size, cache_dir=args.model_cache_dir, model_dir=args.model_dir,
+                               num_workers=num_workers)
         e = time.time()
         logger.info(f"done. It took {round(e - t, 2)} seconds.")
 
@@ -92,18 +133,52 @@ def asr_factory(args, logfile=sys.stderr):
     else:
         tgt_language = language  # Whisper transcribes in this language
 
-    # Create the tokenizer , removed by zt since it can't be installed
-    tokenizer = None
+    online = online_factory(args, asr, logfile=logfile)
+    return asr, online
+
+def online_factory(args, asr, logfile=sys.stderr):
+    """
+    Creates a new ASR Online processor (a streaming session) on top of the ASR instance, configured by the arguments.
+    """
+    # Create the tokenizer. The built-in punctuation-based splitter replaces MosesTokenizer, which can't be installed
+    if args.buffer_trimming == "sentence":
+        from .ASRProcessor import SentenceSplitter
+        tokenizer = SentenceSplitter()
+    else:
+        tokenizer = None
+    language_lock = None
+    if args.lan == "auto" and getattr(args, 'language_lock', 0) > 0:
+        from .ASRProcessor import LanguageLock
+        language_lock = LanguageLock(detections=args.language_lock, recheck_sec=args.language_recheck,
+                                     recheck_utterance=args.language_recheck_utterance)
+
+    decoding_policy = None
+    if getattr(args, 'adaptive_decoding', False):
+        from .ASRProcessor import DecodingPolicy
+        decoding_policy = DecodingPolicy()
+
+    vad_gate = getattr(args, 'vad_gate', False)
+    if vad_gate and args.vac:
+        # VAC already processes only the voiced audio, the gate would run a second Silero VAD on the stream
+        logger.warning("--vad-gate is ignored with --vac")
+        vad_gate = False
+
     # Create the ASRProcessor
+    online_kw = dict(logfile=logfile, buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec),
+                     feature_cache=args.feature_cache, committed_prefix=args.committed_prefix,
+                     early_stop=args.early_stop, language_lock=language_lock, max_buffer_sec=args.max_buffer_sec,
+                     decoding_policy=decoding_policy, vad_gate=vad_gate,
+                     vad_cache=getattr(args, 'vad_cache', False),
+                     excise_silence=getattr(args, 'excise_silence', None),
+                     on_iteration=log_iteration_timing if getattr(args, 'stage_timing', False) else None)
     if args.vac:
         from .ASRProcessor import VACOnlineASRProcessor
-        online = VACOnlineASRProcessor(args.min_chunk_size, asr, tokenizer, logfile=logfile,
-                                       buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec))
+        online = VACOnlineASRProcessor(args.min_chunk_size, asr, tokenizer, vad_thread=getattr(args, 'vac_thread', False),
+                                       pipelined_finish=getattr(args, 'vac_pipelined_finish', False), **online_kw)
     else:
         from .ASRProcessor import OnlineASRProcessor
-        online = OnlineASRProcessor(asr, tokenizer, logfile=logfile,
-                                    buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec))
-    return asr, online
+        online = OnlineASRProcessor(asr, tokenizer, **online_kw)
+    return online
 
 def output_transcript(o, now=None):
     # output format in stdout is like:
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import logging
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .whisper_online import *
+######### Server objects
+from .line_packet import *
+
+
+logger = logging.getLogger(__name__)
+parser = argparse.ArgumentParser(
+    description="Streaming server for many concurrent TCP clients. Every connection has its own online ASR processor, "
+                "they share one Whisper model. The protocol is the same as of whisper_online_server.")
+
+# server options
+parser.add_argument("--host", type=str, default='localhost')
+parser.add_argument("--port", type=int, default=43007)
+parser.add_argument("--warmup_file", type=str, default="tests/data/samples_jfk.wav",
+        help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast. It can be e.g. https://github.com/ggerganov/whisper.cpp/raw/master/samples/jfk.wav .")
+parser.add_argument("--interim", action="store_true", default=False,
+        help="Send also the uncommitted tail of the transcript as delta lines '* <keep> <text>': keep the first <keep> characters of the previous interim text and append <text>.")
+parser.add_argument("--sessions", type=int, default=0,
+        help="Keep the state of this many interrupted streams in memory, so that a client can reconnect and continue. The client then starts with a line of its session token (empty for a new session) and the server answers 'session <token>'. 0 disables it.")
+parser.add_argument("--session-ttl", type=float, default=600,
+        help="Seconds for which the state of an interrupted stream is kept with --sessions.")
+parser.add_argument("--max-clients", type=int, default=16,
+        help="Maximum number of concurrent connections. The connections over the limit are closed immediately.")
+parser.add_argument("--asr-workers", type=int, default=2,
+        help="Number of processing iterations that run in parallel: the threads of the executor, and the parallel workers of the model.")
+parser.add_argument("--batch-window", type=float, default=0,
+        help="Batch the processing iterations of the concurrent streams that come within this many seconds, e.g. 0.05. It trades latency for throughput. 0 disables batching.")
+parser.add_argument("--max-batch", type=int, default=8,
+        help="Maximum number of streams in a batch with --batch-window.")
+
+# options from whisper_online
+add_shared_args(parser)
+
+
+class AsyncConnection:
+    '''the same as Connection, on asyncio streams'''
+    PACKET_SIZE = Connection.PACKET_SIZE
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_line = ""
+
+    def send(self, line):
+        '''it doesn't send the same line twice, see Connection.send. The line is sent by the next drain()'''
+        if line == self.last_line:
+            return
+        self.writer.write(line.encode('utf-8', errors='replace') + b'\n')
+        self.last_line = line
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def receive_header(self, limit=256):
+        '''receives a short line of text that precedes the audio'''
+        data = b''
+        while len(data) < limit:
+            byte = await self.reader.read(1)
+            if not byte or byte == b'\n':
+                break
+            data += byte
+        return data.decode('utf-8', errors='replace').strip()
+
+    async def receive_audio(self):
+        try:
+            return await self.reader.read(self.PACKET_SIZE)
+        except ConnectionResetError:
+            return None
+
+
+class AsyncServerProcessor(ServerProcessor):
+    '''Serves one client connection on the event loop. The processing iterations run in the executor, so that the
+    other connections are served meanwhile.'''
+
+    def __init__(self, c, online_asr_proc, min_chunk, executor, interim=False, sessions=None):
+        super().__init__(c, online_asr_proc, min_chunk, interim=interim, sessions=sessions)
+        self.executor = executor
+
+    async def receive_audio_chunk(self):
+        # the same as ServerProcessor.receive_audio_chunk, it waits for min_chunk seconds of audio
+        minlimit = self.min_chunk*SAMPLING_RATE
+        while len(self.pcm) < minlimit:
+            raw_bytes = await self.connection.receive_audio()
+            if not raw_bytes:
+                break
+            self.pcm.feed(raw_bytes)
+        if len(self.pcm) == 0:
+            return None
+        if self.is_first and len(self.pcm) < minlimit:
+            return None
+        self.is_first = False
+        return self.pcm.take()
+
+    def process_chunk(self, a):
+        # runs in the executor
+        self.online_asr_proc.insert_audio_chunk(a)
+        return self.online_asr_proc.process_iter()
+
+    async def process(self):
+        loop = asyncio.get_running_loop()
+        if self.sessions is not None:
+            token = self.start_session(await self.connection.receive_header())
+        else:
+            self.online_asr_proc.init()
+        try:
+            while True:
+                a = await self.receive_audio_chunk()
+                if a is None:
+                    break
+                o = await loop.run_in_executor(self.executor, self.process_chunk, a)
+                self.send_result(o)
+                if self.interim:
+                    self.send_interim(self.online_asr_proc.interim)
+                await self.connection.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("broken pipe -- connection closed?")
+        if self.sessions is not None:
+            self.store_session(token)
+
+
+async def serve(args, asr):
+    workers = args.asr_workers
+    if args.batch_window > 0:
+        from .WhisperBackend import MicroBatchASR
+        asr = MicroBatchASR(asr, window=args.batch_window, max_batch=args.max_batch)
+        workers = args.max_clients  # the iterations mostly wait for their batch, every client needs its thread
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ASR")
+    sessions = SessionStore(args.sessions, args.session_ttl) if args.sessions > 0 else None
+    idle = []  # online ASR processors of the closed connections, to be reused
+    clients = 0
+
+    async def handle_client(reader, writer):
+        nonlocal clients
+        addr = writer.get_extra_info('peername')
+        if clients >= args.max_clients:
+            logger.warning(f'Refusing the client on {addr}, there are already {clients} clients')
+            writer.close()
+            await writer.wait_closed()
+            return
+        clients += 1
+        logger.info(f'Connected to client on {addr}, clients: {clients}')
+        online = idle.pop() if idle else online_factory(args, asr)
+        try:
+            proc = AsyncServerProcessor(AsyncConnection(reader, writer), online, args.min_chunk_size, executor,
+                                        interim=args.interim, sessions=sessions)
+            await proc.process()
+        except Exception as e:
+            # the failed processor may still run in the executor, it isn't reused
+            logger.error(f'Error while serving the client on {addr}: {e}')
+        else:
+            idle.append(online)
+        finally:
+            clients -= 1
+            writer.close()
+            logger.info(f'Connection to client on {addr} closed, clients: {clients}')
+
+    server = await asyncio.start_server(handle_client, args.host, args.port)
+    logger.info('Listening on'+str((args.host, args.port)))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    set_logging(args,logger,other="")
+
+    asr, _ = asr_factory(args)
+
+    # warm up the ASR because the very first transcribe takes more time than the others.
+    msg = "Whisper is not warmed up. The first chunk processing may take longer."
+    if args.warmup_file:
+        if os.path.isfile(args.warmup_file):
+            a = load_audio_chunk(args.warmup_file,0,1)
+            asr.transcribe(a)
+            logger.info("Whisper is warmed up.")
+        else:
+            logger.critical("The warm up file is not available. "+msg)
+            sys.exit(1)
+    else:
+        logger.warning(msg)
+
+    asyncio.run(serve(args, asr))
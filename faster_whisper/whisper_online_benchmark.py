@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import copy
+import glob
+import itertools
+import json
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from .whisper_online import add_shared_args, asr_factory, load_audio, online_factory, set_logging
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data")
+
+
+def audio_files(paths):
+    """expands the directories in paths to the audio files in them"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(f for f in glob.glob(os.path.join(path, "**", "*"), recursive=True)
+                                if f.lower().endswith(AUDIO_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(values))}
+
+
+def buffer_length(online):
+    """length of the audio buffer of the ASR processor in seconds, also for VAC"""
+    online = getattr(online, "online", online)
+    return len(online.audio_buffer) / SAMPLING_RATE
+
+
+def replay(online, audio, chunk_size):
+    """Replays audio through the online processor in the simultaneous mode, on a simulated clock.
+
+    The clock runs at the speed of the audio while the processor waits for the next chunk, and it is advanced by
+    the measured compute time of every call. So the emission times are the same as in real time streaming, but
+    there is no sleeping.
+    Returns: a dict of the run statistics
+    """
+    duration = len(audio) / SAMPLING_RATE
+    clock = 0.0
+    compute = 0.0
+    beg = 0.0
+    latencies = []  # emission time - end of the emitted text
+    delays = []  # received audio time - end of the emitted text
+    peak_buffer = 0.0
+    iterations = 0
+
+    online.init()
+    while True:
+        if beg < duration:
+            end = min(duration, max(clock, beg + chunk_size))
+            clock = max(clock, end)
+        t = time.perf_counter()
+        if beg < duration:
+            online.insert_audio_chunk(audio[int(beg * SAMPLING_RATE):int(end * SAMPLING_RATE)])
+            peak_buffer = max(peak_buffer, buffer_length(online))
+            o = online.process_iter()
+        else:
+            o = online.finish()
+        elapsed = time.perf_counter() - t
+        compute += elapsed
+        clock += elapsed
+        iterations += 1
+        if o[0] is not None:
+            latencies.append(clock - o[1])
+            delays.append(end - o[1])
+        if beg >= duration:
+            break
+        beg = end
+
+    return {
+        "duration": duration,
+        "compute": compute,
+        "rtf": compute / duration if duration else None,
+        "iterations": iterations,
+        "emissions": len(latencies),
+        "emission_latency": percentiles(latencies),
+        "commit_delay": percentiles(delays),
+        "peak_buffer": peak_buffer,
+    }
+
+
+def parse_list(value, type=str, choices=None):
+    """parses a comma-separated list of values, each of them one of choices if they are given"""
+    values = [type(v) for v in value.split(",")]
+    for v in values:
+        if choices is not None and v not in choices:
+            raise argparse.ArgumentTypeError(f"invalid choice: {v!r} (choose from {', '.join(map(repr, choices))})")
+    return values
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Replays audio files through the streaming ASR processors on a simulated clock and reports "
+                    "the real-time factor, emission latency, committed-word delay and peak buffer length as JSON.")
+    parser.add_argument('audio_paths', type=str, nargs="*", default=[DEFAULT_CORPUS],
+                        help="Audio files or directories of them. Default: the test data of the repository.")
+    add_shared_args(parser)
+    parser.add_argument('--min-chunk-sizes', type=lambda v: parse_list(v, float), default=None,
+                        help="Comma-separated list of --min-chunk-size values to benchmark. Default: --min-chunk-size.")
+    parser.add_argument('--trimmings', type=lambda v: parse_list(v, choices=("sentence", "segment")), default=None,
+                        help="Comma-separated list of --buffer_trimming values to benchmark. Default: --buffer_trimming.")
+    parser.add_argument('--vac-modes', type=lambda v: [m == "on" for m in parse_list(v, choices=("on", "off"))],
+                        default=None,
+                        help="Comma-separated list of VAC modes to benchmark, 'on' and/or 'off'. Default: --vac.")
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    set_logging(args, logger, other="_benchmark")
+
+    missing = [path for path in args.audio_paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f"audio path not found: {', '.join(missing)}")
+    files = audio_files(args.audio_paths)
+    if not files:
+        parser.error(f"no audio files ({', '.join(AUDIO_EXTENSIONS)}) found in {', '.join(args.audio_paths)}")
+    asr, _ = asr_factory(args)
+
+    # warm up the ASR because the very first transcribe takes much more time than the other
+    asr.transcribe(load_audio(files[0])[:SAMPLING_RATE])
+
+    runs = []
+    for min_chunk_size, trimming, vac in itertools.product(args.min_chunk_sizes or [args.min_chunk_size],
+                                                            args.trimmings or [args.buffer_trimming],
+                                                            args.vac_modes or [args.vac]):
+        run_args = copy.copy(args)
+        run_args.min_chunk_size = min_chunk_size
+        run_args.buffer_trimming = trimming
+        run_args.vac = vac
+        chunk_size = args.vac_chunk_size if vac else min_chunk_size
+        for path in files:
+            logger.info(f"benchmarking {path}: min chunk {min_chunk_size}, {trimming} trimming, VAC {vac}")
+            # a new processor for every run, so that the adaptive decoding policy starts from its initial level
+            online = online_factory(run_args, asr)
+            stats = replay(online, load_audio(path), chunk_size)
+            runs.append(dict(file=path, min_chunk_size=min_chunk_size, buffer_trimming=trimming, vac=vac, **stats))
+
+    report = {"model": args.model, "language": args.lan, "runs": runs}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
 
+import io
 import os
+import sys
+import json
+import queue
 import logging
-from .whisper_online import *
-######### Server objects
-from .line_packet import *
+import asyncio
 import argparse
-import time
-from fastapi import FastAPI
+from typing import Optional
+from .whisper_online import *
+from .job_queue import JobQueue
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 
 
 logger = logging.getLogger(__name__)
-parser = argparse.ArgumentParser()
+parser = argparse.ArgumentParser(
+    description="Offline transcription server. The clients submit audio files as jobs, and poll or stream their "
+                "results. The jobs are transcribed by BatchedInferencePipeline.")
 
 # server options
 # --language en --model large-v3 --task transcribe
@@ -19,43 +26,125 @@ parser.add_argument("--host", type=str, default='localhost')
 parser.add_argument("--port", type=int, default=43007)
 parser.add_argument("--warmup_file", type=str, default="tests/data/samples_jfk.wav",
         help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast. It can be e.g. https://github.com/ggerganov/whisper.cpp/raw/master/samples/jfk.wav .")
+parser.add_argument("--asr-workers", type=int, default=1,
+        help="Number of jobs that are transcribed in parallel: the worker threads, and the parallel workers of the model.")
+parser.add_argument("--max-queue", type=int, default=16,
+        help="Maximum number of jobs waiting for a worker. The submissions over the limit are refused with 429.")
+parser.add_argument("--max-jobs", type=int, default=1000,
+        help="Number of finished jobs whose results are kept for the clients.")
+parser.add_argument("--batch-size", type=int, default=8,
+        help="Number of 30 s windows of a job that are decoded in one batch.")
+parser.add_argument("--poll-interval", type=float, default=0.2,
+        help="Seconds between the checks of a running job, when its results are streamed.")
 
 # options from whisper_online
 add_shared_args(parser)
-args = parser.parse_args()
-
-set_logging(args,logger,other="")
-
-# setting whisper object by args
-size = args.model
-language = args.lan
-asr, online = asr_factory(args)
-min_chunk = args.min_chunk_size
-SAMPLING_RATE = 16000
-
-# warm up the ASR because the very first transcribe takes more time than the others.
-# Test results in https://github.com/ufal/whisper_streaming/pull/81
-msg = "Whisper is not warmed up. The first chunk processing may take longer."
-if args.warmup_file:
-    if os.path.isfile(args.warmup_file):
-        a = load_audio_chunk(args.warmup_file,0,1)
-        asr.transcribe(a)
-        logger.info("Whisper is warmed up.")
+
+
+async def wait_job(job, interval):
+    '''waits for the job on the event loop, without blocking a thread'''
+    while not job.done.is_set():
+        await asyncio.sleep(interval)
+
+
+def create_app(jobs, poll_interval=0.2):
+    '''Returns the FastAPI application serving the jobs of the JobQueue "jobs".
+
+    POST /jobs: the body is an audio file in any format readable by PyAV. The query parameters language, task and
+        word_timestamps override the options of the server for the job. Returns the id and the status of the job.
+    GET /jobs/{id}: the status, the segments transcribed so far, and when finished, the compute time and the
+        real-time factor of the job.
+    GET /jobs/{id}/stream: the segments as lines of JSON as soon as they are transcribed, then the final status.
+    '''
+    app = FastAPI()
+
+    def get_job(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+    @app.post("/jobs", status_code=202)
+    async def submit(request: Request, language: Optional[str] = None, task: Optional[str] = None,
+                     word_timestamps: Optional[bool] = None):
+        body = await request.body()
+        if not body:
+            raise HTTPException(status_code=400, detail="The request body must be an audio file")
+        options = dict(language=language, task=task, word_timestamps=word_timestamps)
+        try:
+            job = jobs.submit(io.BytesIO(body), **{k: v for k, v in options.items() if v is not None})
+        except queue.Full:
+            raise HTTPException(status_code=429, detail="Too many jobs are waiting, try again later")
+        return {"id": job.id, "status": job.status}
+
+    @app.get("/jobs/{job_id}")
+    async def status(job_id: str):
+        return get_job(job_id).to_dict()
+
+    @app.get("/jobs/{job_id}/stream")
+    async def stream(job_id: str):
+        job = get_job(job_id)
+
+        async def lines():
+            sent = 0
+            while True:
+                d = job.to_dict(since=sent)
+                for s in d.pop("segments"):
+                    yield json.dumps(s, ensure_ascii=False) + "\n"
+                    sent += 1
+                if d["status"] in ("done", "failed"):
+                    yield json.dumps(d, ensure_ascii=False) + "\n"
+                    return
+                await asyncio.sleep(poll_interval)
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/fileIds/{fileId}")
+    async def read_root(fileId: int):
+        # the test files of the repository, transcribed as a job
+        try:
+            job = jobs.submit(f"tests/data/samples_jfk{fileId}.wav")
+        except queue.Full:
+            raise HTTPException(status_code=429, detail="Too many jobs are waiting, try again later")
+        await wait_job(job, poll_interval)
+        d = job.to_dict()
+        if d["status"] == "failed":
+            raise HTTPException(status_code=500, detail=d["error"])
+        if not d["segments"]:
+            return ""
+        text = "".join(s["text"] for s in d["segments"])
+        return "%1.0f %1.0f %s" % (d["segments"][0]["start"] * 1000, d["segments"][-1]["end"] * 1000, text)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    from .transcribe import BatchedInferencePipeline
+
+    args = parser.parse_args()
+
+    set_logging(args,logger,other="")
+
+    # setting whisper object by args
+    asr, _ = asr_factory(args)
+
+    # warm up the ASR because the very first transcribe takes more time than the others.
+    # Test results in https://github.com/ufal/whisper_streaming/pull/81
+    msg = "Whisper is not warmed up. The first chunk processing may take longer."
+    if args.warmup_file:
+        if os.path.isfile(args.warmup_file):
+            a = load_audio_chunk(args.warmup_file,0,1)
+            asr.transcribe(a)
+            logger.info("Whisper is warmed up.")
+        else:
+            logger.critical("The warm up file is not available. "+msg)
+            sys.exit(1)
     else:
-        logger.critical("The warm up file is not available. "+msg)
-        sys.exit(1)
-else:
-    logger.warning(msg)
-# server loop
-
-app = FastAPI()
-@app.get("/fileIds/{fileId}")
-def read_root(fileId: int):
-    filePath = f"tests/data/samples_jfk{fileId}.wav"
-    duration = len(load_audio(filePath)) / SAMPLING_RATE
-    logger.info("Audio duration is: %2.2f seconds" % duration)
-    # load the audio into the LRU cache before we start the timer
-    audio = load_audio_chunk(filePath, 0, min_chunk)
-    online.insert_audio_chunk(audio)
-    text = online.process_iter()
-    return "%1.0f %1.0f %s" % (text[0] * 1000, text[1] * 1000, text[2])
\ No newline at end of file
+        logger.warning(msg)
+
+    jobs = JobQueue(lambda: BatchedInferencePipeline(asr.model), workers=args.asr_workers, max_queue=args.max_queue,
+                    max_jobs=args.max_jobs, batch_size=args.batch_size, language=asr.original_language,
+                    **asr.transcribe_kargs)
+    app = create_app(jobs, poll_interval=args.poll_interval)
+    uvicorn.run(app, host=args.host, port=args.port)
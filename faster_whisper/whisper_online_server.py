@@ -16,6 +16,12 @@ parser.add_argument("--host", type=str, default='localhost')
 parser.add_argument("--port", type=int, default=43007)
 parser.add_argument("--warmup_file", type=str, default="tests/data/samples_jfk.wav",
         help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast. It can be e.g. https://github.com/ggerganov/whisper.cpp/raw/master/samples/jfk.wav .")
+parser.add_argument("--interim", action="store_true", default=False,
+        help="Send also the uncommitted tail of the transcript as delta lines '* <keep> <text>': keep the first <keep> characters of the previous interim text and append <text>.")
+parser.add_argument("--sessions", type=int, default=0,
+        help="Keep the state of this many interrupted streams in memory, so that a client can reconnect and continue. The client then starts with a line of its session token (empty for a new session) and the server answers 'session <token>'. 0 disables it.")
+parser.add_argument("--session-ttl", type=float, default=600,
+        help="Seconds for which the state of an interrupted stream is kept with --sessions.")
 
 # options from whisper_online
 add_shared_args(parser)
@@ -42,6 +48,9 @@ if args.warmup_file:
         sys.exit(1)
 else:
     logger.warning(msg)
+
+sessions = SessionStore(args.sessions, args.session_ttl) if args.sessions > 0 else None
+
 # server loop
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -52,7 +61,7 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         conn, addr = s.accept()
         logger.info('Connected to client on {}'.format(addr))
         connection = Connection(conn)
-        proc = ServerProcessor(connection, online, args.min_chunk_size)
+        proc = ServerProcessor(connection, online, args.min_chunk_size, interim=args.interim, sessions=sessions)
         proc.process()
         conn.close()
         logger.info('Connection to client closed')
@@ -1,18 +1,13 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import logging
 import argparse
 import asyncio
 import websockets
 import json
-import wave
-import io
-import numpy as np
-from scipy.io import wavfile
-import tempfile
-import threading
-import queue
+from concurrent.futures import ThreadPoolExecutor
 
 from .whisper_online import *
 from .line_packet import *
@@ -27,160 +22,169 @@ parser.add_argument("--port", type=int, default=8765, help="WebSocket server por
 parser.add_argument("--tcp_port", type=int, default=43007, help="Original TCP server port")
 parser.add_argument("--warmup_file", type=str, default="tests/data/samples_jfk.wav",
                     help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast.")
+parser.add_argument("--interim", action="store_true", default=False,
+                    help="Send also the uncommitted tail of the transcript as messages {\"type\": \"interim\", \"keep\": <keep>, \"text\": <text>}: keep the first <keep> characters of the previous interim text and append <text>.")
+parser.add_argument("--no-ack", dest="ack", action="store_false", default=True,
+                    help="Don't send the message {\"type\": \"ack\", \"status\": \"received\", \"size\": <bytes>} for every received audio message.")
+parser.add_argument("--asr-workers", type=int, default=2,
+                    help="Number of processing iterations that run in parallel: the threads of the executor, and the parallel workers of the model.")
 
 # options from whisper_online
 add_shared_args(parser)
-args = parser.parse_args()
-
-set_logging(args, logger, other="")
-
-# setting whisper object by args
-size = args.model
-language = args.lan
-asr, online = asr_factory(args)
-min_chunk = args.min_chunk_size
-
-# warm up the ASR because the very first transcribe takes more time than the others.
-msg = "Whisper is not warmed up. The first chunk processing may take longer."
-if args.warmup_file:
-    if os.path.isfile(args.warmup_file):
-        a = load_audio_chunk(args.warmup_file, 0, 1)
-        asr.transcribe(a)
-        logger.info("Whisper is warmed up.")
-    else:
-        logger.critical("The warm up file is not available. " + msg)
-        import sys
-
-        sys.exit(1)
-else:
-    logger.warning(msg)
 
 
 class WebSocketASRProcessor:
-    def __init__(self, websocket, asr_model, min_chunk_size):
+    """处理一个WebSocket客户端连接: 接收的PCM数据直接解码到内存, 由该连接自己的在线ASR处理器转录.
+
+    转录在线程池中运行, 不阻塞事件循环, 其他连接在此期间继续被服务. 转录期间收到的音频累积起来, 下一次转录一起处理.
+    客户端发送 {"type": "eof"} 或关闭连接时, 剩余的音频被转录, 并发送finish()的结果.
+    """
+
+    def __init__(self, websocket, online_asr_proc, min_chunk_size, executor, interim=False, ack=True):
+        """min_chunk_size: 每次转录之前至少接收的音频秒数
+        ack: 对每个音频数据块发送确认消息
+        """
         self.websocket = websocket
-        self.asr_model = asr_model
+        self.online_asr_proc = online_asr_proc
         self.min_chunk_size = min_chunk_size
-        self.audio_buffer = b""
-        self.temp_files = []
-
-    async def process_audio_chunk(self, audio_data):
-        """处理音频数据块并返回转录结果"""
+        self.executor = executor
+        self.interim = interim
+        self.ack = ack
+        self.last_interim = ""
+        self.pcm = PCM16Decoder()
+        self.ready = asyncio.Event()  # 已接收足够的音频, 或音频流已结束
+        self.closed = False
+
+    async def send(self, msg):
         try:
-            # 添加新音频数据到缓冲区
-            self.audio_buffer += audio_data
-
-            # 如果缓冲区数据足够大，则进行转录
-            if len(self.audio_buffer) >= self.min_chunk_size:
-                # 创建临时WAV文件
-                temp_wav = self.create_wav_from_pcm(self.audio_buffer)
-
-                # 使用Whisper模型进行转录
-                result = self.asr_model.transcribe(temp_wav)
-
-                # 清空已处理的音频数据
-                self.audio_buffer = b""
-
-                # 返回转录结果
-                if result and 'text' in result:
-                    return result['text']
-                else:
-                    return ""
-
-        except Exception as e:
-            logger.error(f"处理音频块时出错: {e}")
-            return f"处理错误: {str(e)}"
+            await self.websocket.send(json.dumps(msg, ensure_ascii=False))
+        except websockets.exceptions.ConnectionClosed:
+            logger.debug(f'连接已关闭, 未发送: {msg}')
 
-    def create_wav_from_pcm(self, pcm_data):
-        """将PCM数据转换为WAV格式"""
+    async def receive(self):
+        """接收客户端消息, 直到音频流结束或连接关闭"""
+        minlimit = self.min_chunk_size * SAMPLING_RATE
         try:
-            # 假设音频数据是16kHz, 16位, 单声道
-            sample_rate = 16000
-            dtype = np.int16
-
-            # 将字节数据转换为numpy数组
-            audio_array = np.frombuffer(pcm_data, dtype=dtype)
-
-            # 创建临时WAV文件
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-            temp_filename = temp_file.name
-            temp_file.close()
-
-            # 保存为WAV文件
-            wavfile.write(temp_filename, sample_rate, audio_array)
-
-            # 记录临时文件以便清理
-            self.temp_files.append(temp_filename)
-
-            return temp_filename
-        except Exception as e:
-            logger.error(f"创建WAV文件时出错: {e}")
-            raise
-
-
-async def handle_client(websocket, path):
-    """处理WebSocket客户端连接"""
-    logger.info(f'新的WebSocket客户端连接: {websocket.remote_address}')
-
-    processor = WebSocketASRProcessor(websocket, asr, min_chunk)
-
-    try:
-        async for message in websocket:
-            if isinstance(message, bytes):
-                # 接收到音频数据
-                logger.info(f'收到音频数据: {len(message)} 字节')
-
-                # 处理音频数据并获取转录结果
-                transcript = await processor.process_audio_chunk(message)
-
-                if transcript:
-                    # 发送转录结果
-                    response = {
-                        "type": "transcript",
-                        "text": transcript,
-                        "timestamp": asyncio.get_event_loop().time()
-                    }
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
-                    logger.info(f'发送转录结果: {transcript}')
+            async for message in self.websocket:
+                if isinstance(message, bytes):
+                    # 接收到音频数据
+                    logger.debug(f'收到音频数据: {len(message)} 字节')
+                    self.pcm.feed(message)
+                    if len(self.pcm) >= minlimit:
+                        self.ready.set()
+                    if self.ack:
+                        # 发送确认消息
+                        await self.send({"type": "ack", "status": "received", "size": len(message)})
                 else:
-                    # 发送确认消息
-                    ack_msg = {
-                        "type": "ack",
-                        "status": "received",
-                        "size": len(message)
-                    }
-                    await websocket.send(json.dumps(ack_msg))
-            else:
-                # 如果收到文本消息，可能是控制命令
-                try:
-                    cmd = json.loads(message)
+                    # 如果收到文本消息，可能是控制命令
+                    try:
+                        cmd = json.loads(message)
+                    except json.JSONDecodeError:
+                        logger.warning(f'收到未知格式消息: {message}')
+                        continue
                     if cmd.get("type") == "ping":
-                        pong_msg = {"type": "pong"}
-                        await websocket.send(json.dumps(pong_msg))
-                except json.JSONDecodeError:
-                    logger.warning(f'收到未知格式消息: {message}')
-
-    except websockets.exceptions.ConnectionClosed:
-        logger.info(f'WebSocket客户端断开连接: {websocket.remote_address}')
-    except Exception as e:
-        logger.error(f'处理客户端时出错: {e}')
-    finally:
-        # 清理临时文件
-        for temp_file in processor.temp_files:
-            try:
-                os.unlink(temp_file)
-            except OSError:
-                pass
-
-
-# 启动WebSocket服务器
-logger.info(f'启动WebSocket服务器在 {args.host}:{args.port}')
-
-start_server = websockets.serve(handle_client, args.host, args.port)
-
-logger.info(f'WebSocket服务器监听中: ws://{args.host}:{args.port}')
-logger.info(f'原始TCP服务器端口: {args.tcp_port} (保留兼容性)')
-
-# 启动事件循环
-asyncio.get_event_loop().run_until_complete(start_server)
-asyncio.get_event_loop().run_forever()
\ No newline at end of file
+                        await self.send({"type": "pong"})
+                    elif cmd.get("type") == "eof":
+                        break
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f'WebSocket客户端断开连接: {self.websocket.remote_address}')
+        finally:
+            self.closed = True
+            self.ready.set()
+
+    def process_chunk(self, a):
+        # 在线程池中运行
+        self.online_asr_proc.insert_audio_chunk(a)
+        return self.online_asr_proc.process_iter()
+
+    async def send_result(self, o):
+        loop = asyncio.get_running_loop()
+        if o[0] is not None:
+            # 发送转录结果
+            await self.send({"type": "transcript", "text": o[2], "start": o[0], "end": o[1],
+                             "timestamp": loop.time()})
+            logger.info(f'发送转录结果: {o[2]}')
+        if self.interim:
+            text = self.online_asr_proc.interim[2]
+            if text != self.last_interim:
+                keep, suffix = interim_delta(self.last_interim, text)
+                self.last_interim = text
+                await self.send({"type": "interim", "keep": keep, "text": suffix})
+
+    async def transcribe(self):
+        """每当接收到至少min_chunk_size秒的音频, 转录并发送结果. 音频流结束后, 转录剩余的音频并发送finish()的结果."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            closed = self.closed
+            if len(self.pcm):
+                a = self.pcm.take()
+                o = await loop.run_in_executor(self.executor, self.process_chunk, a)
+                await self.send_result(o)
+            if closed:
+                o = await loop.run_in_executor(self.executor, self.online_asr_proc.finish)
+                await self.send_result(o)
+                break
+
+    async def process(self):
+        """接收和转录并行运行, 其中一个出错时, 另一个被取消, 异常被抛出"""
+        self.online_asr_proc.init()
+        tasks = [asyncio.create_task(self.receive()), asyncio.create_task(self.transcribe())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            task.result()
+
+
+async def serve(args, asr):
+    executor = ThreadPoolExecutor(max_workers=args.asr_workers, thread_name_prefix="ASR")
+    idle = []  # 已关闭连接的在线ASR处理器, 供新连接重用
+
+    async def handle_client(websocket, path=None):
+        """处理WebSocket客户端连接"""
+        logger.info(f'新的WebSocket客户端连接: {websocket.remote_address}')
+        online = idle.pop() if idle else online_factory(args, asr)
+        try:
+            await WebSocketASRProcessor(websocket, online, args.min_chunk_size, executor,
+                                        interim=args.interim, ack=args.ack).process()
+        except Exception as e:
+            # 出错的处理器可能仍在线程池中运行, 不再重用
+            logger.error(f'处理客户端时出错: {e}')
+            return
+        idle.append(online)
+        logger.info(f'WebSocket客户端连接结束: {websocket.remote_address}')
+
+    # 启动WebSocket服务器
+    logger.info(f'启动WebSocket服务器在 {args.host}:{args.port}')
+    async with websockets.serve(handle_client, args.host, args.port):
+        logger.info(f'WebSocket服务器监听中: ws://{args.host}:{args.port}')
+        logger.info(f'原始TCP服务器端口: {args.tcp_port} (保留兼容性)')
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    set_logging(args, logger, other="")
+
+    # setting whisper object by args
+    asr, _ = asr_factory(args)
+
+    # warm up the ASR because the very first transcribe takes more time than the others.
+    msg = "Whisper is not warmed up. The first chunk processing may take longer."
+    if args.warmup_file:
+        if os.path.isfile(args.warmup_file):
+            a = load_audio_chunk(args.warmup_file, 0, 1)
+            asr.transcribe(a)
+            logger.info("Whisper is warmed up.")
+        else:
+            logger.critical("The warm up file is not available. " + msg)
+            sys.exit(1)
+    else:
+        logger.warning(msg)
+
+    asyncio.run(serve(args, asr))
@@ -0,0 +1,577 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from faster_whisper.ASRProcessor.AudioBuffer import AudioBuffer
+from faster_whisper.ASRProcessor.CommittedWords import CommittedWords
+from faster_whisper.ASRProcessor.DecodingPolicy import DecodingPolicy
+from faster_whisper.ASRProcessor.FeatureCache import FeatureCache
+from faster_whisper.ASRProcessor.HypothesisBuffer import HypothesisBuffer
+from faster_whisper.ASRProcessor.LanguageLock import LanguageLock
+from faster_whisper.ASRProcessor.OnlineASRProcessor import OnlineASRProcessor
+from faster_whisper.ASRProcessor.SentenceSplitter import SentenceSplitter
+from faster_whisper.ASRProcessor.VACOnlineASRProcessor import VACOnlineASRProcessor
+from faster_whisper.ASRProcessor.VADCache import VADCache
+from faster_whisper.ASRProcessor.VADWorker import VADWorker
+from faster_whisper.audio import decode_audio
+from faster_whisper.feature_extractor import FeatureExtractor
+from faster_whisper.silero_vad_iterator import FixedVADIterator, VADIterator
+from faster_whisper.vad import StreamingSileroVAD, get_speech_timestamps, get_vad_model
+
+
+def test_audio_buffer_append_and_trim():
+    buffer = AudioBuffer(capacity=4)
+    expected = np.array([], dtype=np.float32)
+
+    for i in range(20):
+        chunk = np.arange(i * 3, i * 3 + 3, dtype=np.float32)
+        buffer.append(chunk)
+        expected = np.append(expected, chunk)
+        if i % 4 == 3:
+            buffer.trim(5)
+            expected = expected[5:]
+
+        assert len(buffer) == len(expected)
+        np.testing.assert_array_equal(buffer.view(), expected)
+
+    buffer.keep_last(2)
+    np.testing.assert_array_equal(buffer.view(), expected[-2:])
+    buffer.clear()
+    assert len(buffer) == 0
+
+
+def test_audio_buffer_views_survive_appends():
+    buffer = AudioBuffer(capacity=4)
+    buffer.append(np.ones(3, dtype=np.float32))
+    view = buffer.view()
+
+    buffer.trim(2)
+    buffer.append(np.zeros(10, dtype=np.float32))
+
+    np.testing.assert_array_equal(view, np.ones(3, dtype=np.float32))
+    assert view.flags["C_CONTIGUOUS"]
+
+
+def test_feature_cache_matches_feature_extractor():
+    feature_extractor = FeatureExtractor()
+    cache = FeatureCache(feature_extractor)
+    rng = np.random.default_rng(0)
+    audio = np.array([], dtype=np.float32)
+
+    for i in range(12):
+        chunk = rng.standard_normal(int(rng.integers(100, 16000))).astype(np.float32)
+        audio = np.append(audio, 0.1 * chunk)
+        if i % 4 == 3:
+            cut = int(rng.integers(0, len(audio) // 2))
+            if i % 8 == 3:
+                cut -= cut % feature_extractor.hop_length
+            audio = audio[cut:]
+            cache.trim(cut)
+
+        expected = feature_extractor(audio)
+        features = cache(audio)
+        assert features.shape == expected.shape
+        np.testing.assert_allclose(features, expected, atol=1e-5)
+
+
+def test_hypothesis_commit_settled():
+    hypothesis = HypothesisBuffer()
+    words = [(0.0, 0.5, " ask"), (0.5, 1.0, " not"), (1.0, 1.5, " what")]
+    hypothesis.insert(words, 0)
+    assert hypothesis.commit_settled()  # nothing to agree with yet
+    assert hypothesis.flush() == []
+
+    hypothesis.insert(words[:2], 0)
+    assert not hypothesis.commit_settled()
+    hypothesis.insert(words[:2] + [(1.0, 1.5, " why")], 0)
+    assert hypothesis.commit_settled()
+    assert hypothesis.flush() == words[:2]
+
+
+def test_language_lock():
+    lock = LanguageLock(detections=2, threshold=0.5, recheck_sec=30)
+    assert lock.language(1.0) is None
+    lock.update("de", 0.9, 1.0)
+    assert lock.language(2.0) is None
+    lock.update("de", 0.3, 2.0)  # not confident, the count starts again
+    lock.update("de", 0.9, 3.0)
+    assert lock.language(4.0) is None
+    lock.update("de", 0.9, 4.0)
+    assert lock.language(5.0) == "de"
+
+    assert lock.language(34.0) is None  # re-check
+    lock.update("fr", 0.9, 34.0)
+    assert lock.language(35.0) == "fr"
+
+    lock.request_recheck()
+    assert lock.language(36.0) is None
+    lock.update("en", 0.2, 36.0)
+    assert lock.language(37.0) == "fr"
+
+
+def test_committed_words_prompt():
+    dropped = []
+    committed = CommittedWords(prompt_size=20, sink=dropped.extend)
+    words = [(i, i + 1, " w%d" % i) for i in range(30)]
+
+    for i in range(0, 30, 3):
+        committed.extend(words[i:i + 3])
+        committed.advance(i)
+        prompt = "".join(t for _, _, t in committed.prompt_words)
+        if dropped:
+            # the shortest suffix of at least 20 characters (counting a separator per word)
+            assert len(prompt) + len(committed.prompt_words) >= 20
+            assert len(prompt) + len(committed.prompt_words) - len(committed.prompt_words[0][2]) - 1 < 20
+        assert [w for w, _, _ in committed.context] == list(range(i, i + 3))
+        assert dropped + list(committed) == words[:i + 3]
+
+    committed.clear()
+    assert len(committed) == 0
+    assert dropped == words
+
+
+def test_sentence_splitter():
+    splitter = SentenceSplitter()
+    text = 'Hello world. See e.g. this one! Really?" He said 3.5 times... 我们走吧。好的！ Then'
+    assert splitter.split(text) == [
+        "Hello world.",
+        "See e.g. this one!",
+        'Really?"',
+        "He said 3.5 times...",
+        "我们走吧。",
+        "好的！",
+        "Then",
+    ]
+    # the next word is lowercase after any whitespace, also outside of ASCII
+    text = "Apples, pears etc.  and more. Vgl. über 3 Sachen. Mr. élan vital! Écoute."
+    assert splitter.split(text) == [
+        "Apples, pears etc.  and more.",
+        "Vgl. über 3 Sachen.",
+        "Mr. élan vital!",
+        "Écoute.",
+    ]
+
+
+def test_words_to_sentences():
+    processor = OnlineASRProcessor.__new__(OnlineASRProcessor)
+    processor.tokenizer = SentenceSplitter()
+    words = [(0, 1, " Hi."), (1, 2, " It"), (2, 3, " works."), (3, 4, "我们"), (4, 5, "走吧。"), (5, 6, " And")]
+    assert processor.words_to_sentences(words) == [
+        (0, 1, "Hi."),
+        (1, 3, "It works."),
+        (3, 5, "我们 走吧。"),
+        (5, 6, "And"),
+    ]
+
+
+def test_decoding_policy():
+    policy = DecodingPolicy(high=0.8, low=0.5, patience=2)
+    assert policy.options() == {}
+
+    for _ in range(4):
+        policy.update(compute_time=1.5, audio_time=1.0)
+    assert policy.level == 2
+    assert policy.options()["beam_size"] == 1
+
+    for _ in range(20):
+        policy.update(compute_time=0.6, audio_time=1.0)  # between the thresholds
+    level = policy.level
+    for _ in range(20):
+        policy.update(compute_time=0.6, audio_time=1.0)
+    assert policy.level == level > 0
+
+    for _ in range(40):
+        policy.update(compute_time=0.1, audio_time=1.0)
+    assert policy.options() == {}
+
+
+
+def test_shared_decoding_policy():
+    # the finalizer thread and the caller's thread update the policy at the same time
+    barrier = threading.Barrier(2)
+
+    class MeetingLevels(tuple):
+        def __len__(self):
+            try:
+                barrier.wait(0.5)  # both threads are in the check of the level, unless it is locked
+            except threading.BrokenBarrierError:
+                pass
+            return super().__len__()
+
+    policy = DecodingPolicy(high=0.8, patience=1, levels=MeetingLevels(DecodingPolicy.LEVELS))
+    policy.restore(dict(policy.snapshot(), level=len(DecodingPolicy.LEVELS) - 2))
+    threads = [threading.Thread(target=policy.update, args=(1.5, 1.0)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert policy.level == len(DecodingPolicy.LEVELS) - 1
+    assert policy.options() == DecodingPolicy.LEVELS[-1]
+
+    lock = LanguageLock(detections=1000)
+    threads = [threading.Thread(target=lambda: [lock.update("en", 0.9, 0.0) for _ in range(500)]) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert lock.snapshot()["count"] == 1000 and lock.language(0.0) == "en"
+
+
+def test_streaming_vad_matches_silero_model(jfk_path):
+    audio = decode_audio(jfk_path)
+    audio = audio[: len(audio) - len(audio) % 512]
+    expected = get_vad_model()(audio.copy())
+
+    vad = StreamingSileroVAD()
+    probs = np.concatenate(
+        [vad(audio[i : i + 512 * 7]) for i in range(0, len(audio), 512 * 7)]
+    )
+    # SileroVADModel overwrites the end of the last window with zeros
+    np.testing.assert_allclose(probs[:-1], expected[:-1], atol=1e-5)
+
+
+class WindowValueModel:
+    """fake VAD model: the speech probability of a window is its first sample"""
+
+    def reset_states(self):
+        pass
+
+    def __call__(self, audio):
+        return audio.reshape(-1, 512)[:, 0]
+
+
+def test_fixed_vad_iterator_matches_window_by_window():
+    rng = np.random.default_rng(0)
+    # runs of speech, silence and uncertain windows
+    probs = np.repeat(rng.choice([0.9, 0.1, 0.4], size=300), rng.integers(1, 30, size=300))
+    audio = np.repeat(probs, 512).astype(np.float32)
+
+    for return_seconds in (False, True):
+        fixed = FixedVADIterator(WindowValueModel())
+        reference = VADIterator(WindowValueModel())
+        buffered = np.zeros(0, dtype=np.float32)
+        pos = 0
+        while pos < len(audio):
+            chunk = audio[pos : pos + int(rng.integers(1, 512 * 40))]
+            pos += len(chunk)
+
+            expected = None
+            buffered = np.concatenate([buffered, chunk])
+            while len(buffered) >= 512:
+                r = reference(buffered[:512], return_seconds=return_seconds)
+                buffered = buffered[512:]
+                if expected is None:
+                    expected = r
+                elif r is not None:
+                    if "end" in r:
+                        expected["end"] = r["end"]
+                    if "start" in r and "end" in expected:
+                        del expected["end"]
+            if expected == {}:
+                expected = None
+
+            assert fixed(chunk, return_seconds=return_seconds) == expected
+
+
+def test_vad_worker():
+    def vac(audio):
+        if len(audio) == 0:
+            raise ValueError("empty chunk")
+        return {"start": int(audio[0])}
+
+    worker = VADWorker(vac)
+    chunks = [np.full(3, i, dtype=np.float32) for i in range(50)]
+    for chunk in chunks:
+        worker.put(chunk)
+    worker.wait()
+    for i, chunk in enumerate(chunks):
+        audio, res = worker.get()
+        assert audio is chunk and res == {"start": i}
+    assert worker.get() is None
+
+    worker.put(np.zeros(0, dtype=np.float32))
+    with pytest.raises(ValueError):
+        worker.get(block=True)
+    worker.stop()
+    assert not worker.thread.is_alive()
+
+
+def test_vad_cache(jfk_path):
+    audio = np.concatenate([decode_audio(jfk_path), np.zeros(16000 * 3, dtype=np.float32)])
+    expected = StreamingSileroVAD()(audio[: len(audio) - len(audio) % 512])
+
+    cache = VADCache()
+    for i in range(0, len(audio), 1000):
+        cache.append(audio[i : i + 1000])
+    np.testing.assert_allclose(cache.probs.view(), expected, atol=1e-6)
+
+    assert cache.voiced_since(16000 * 10)
+    assert not cache.voiced_since(len(audio) - 16000 * 2)
+    cache.trim(16000 * 10 + 100)
+    assert cache.start == 16000 * 10 // 512 * 512
+    np.testing.assert_allclose(cache.probs.view(), expected[16000 * 10 // 512 :], atol=1e-6)
+
+
+def test_speech_timestamps_from_cached_probs(jfk_path):
+    audio = decode_audio(jfk_path)
+    cache = VADCache()
+    cache.append(audio)
+
+    expected = get_speech_timestamps(audio, min_silence_duration_ms=160)
+    speech_chunks = get_speech_timestamps(
+        audio, min_silence_duration_ms=160, speech_probs=cache.probs.view()
+    )
+    assert speech_chunks == expected
+
+
+class EdgeWordsASR:
+    """fake ASR: a word at the beginning and at the end of the transcribed audio"""
+
+    sep = ""
+    transcribe_kargs = {}
+
+    def transcribe_stream(self, audio, **kwargs):
+        self.transcribed = len(audio)
+        end = len(audio) / 16000
+        words = [
+            SimpleNamespace(start=0.0, end=0.5, word=" first"),
+            SimpleNamespace(start=end - 0.5, end=end, word=" last"),
+        ]
+        segment = SimpleNamespace(start=0.0, end=end, words=words)
+        return iter([segment]), SimpleNamespace(language="en", language_probability=1.0)
+
+    def ts_words(self, segments):
+        return [(w.start, w.end, w.word) for s in segments for w in s.words]
+
+    def segments_end_ts(self, segments):
+        return [s.end for s in segments]
+
+
+class ClockWordsASR(EdgeWordsASR):
+    """fake ASR: the samples are their stream times, the words " w0", " w1", ... are at the stream times
+    [k / 2, k / 2 + 0.37], and all of them are in one segment"""
+
+    def transcribe_stream(self, audio, **kwargs):
+        start, end = float(audio[0]), float(audio[-1]) + 1 / 16000
+        words = [
+            SimpleNamespace(start=max(0.0, k / 2 - start), end=k / 2 + 0.37 - start, word=f" w{k}")
+            for k in range(int(end * 2) + 1)
+            if start < k / 2 + 0.37 <= end
+        ]
+        segment = SimpleNamespace(start=0.0, end=end - start, words=words)
+        return iter([segment]), SimpleNamespace(language="en", language_probability=1.0)
+
+
+def test_forced_trim():
+    processor = OnlineASRProcessor(ClockWordsASR(), max_buffer_sec=3)
+    processor.trim_alignment = 512
+    out = []
+    for i in range(20):
+        processor.insert_audio_chunk(np.arange(i * 16000, (i + 1) * 16000, dtype=np.float32) / 16000)
+        out.append(processor.process_iter())
+        assert len(processor.audio_buffer) / 16000 <= 3
+        assert processor.buffer_time_offset * 16000 % 512 == 0
+    out.append(processor.finish())
+    assert processor.forced_trims > 0
+    # the words cut by the aligned trims are not committed twice
+    assert "".join(o[2] for o in out) == "".join(f" w{k}" for k in range(40))
+
+
+class RecordingASR(ClockWordsASR):
+    """ClockWordsASR that records the keyword arguments of its calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe_stream(self, audio, **kwargs):
+        self.calls.append(kwargs)
+        return super().transcribe_stream(audio, **kwargs)
+
+
+@pytest.mark.parametrize("committed_prefix", [False, True])
+def test_committed_prefix(committed_prefix):
+    asr = RecordingASR()
+    processor = OnlineASRProcessor(asr, committed_prefix=committed_prefix, max_buffer_sec=3)
+    for i in range(5):
+        processor.insert_audio_chunk(np.arange(i * 16000, (i + 1) * 16000, dtype=np.float32) / 16000)
+        processor.process_iter()
+
+    # the commited words inside the buffer are forced as the prefix, the scrolled away ones are the prompt
+    prefixes = ["", "", " w0 w1", " w0 w1 w2 w3", " w5"]
+    assert [c["prefix"] for c in asr.calls] == (prefixes if committed_prefix else [None] * 5)
+    assert [c["init_prompt"] for c in asr.calls] == ["", "", "", "", " w0 w1 w2 w3 w4"]
+
+
+def test_faster_whisper_asr_prefix():
+    from faster_whisper.WhisperBackend import FasterWhisperASR
+    from faster_whisper.transcribe import WhisperModel
+
+    calls = []
+    asr = FasterWhisperASR.__new__(FasterWhisperASR)
+    asr.model = SimpleNamespace(transcribe=lambda audio, **kwargs: calls.append(kwargs))
+    asr.transcribe_kargs = {}
+    asr.original_language = "en"
+    asr.transcribe_stream(np.zeros(16000, dtype=np.float32), init_prompt="before", prefix=" w0 w1")
+    asr.transcribe_stream(np.zeros(16000, dtype=np.float32), init_prompt="before", prefix="")
+    assert [(c["initial_prompt"], c["prefix"]) for c in calls] == [("before", " w0 w1"), ("before", None)]
+
+    # the prompt goes after <|startofprev|>, the prefix after the start of the transcript
+    tokenizer = SimpleNamespace(sot_prev=1, sot_sequence=[2, 3], no_timestamps=4, timestamp_begin=5,
+                                encode=lambda text: [ord(c) for c in text])
+    model = SimpleNamespace(max_length=448)
+    assert WhisperModel.get_prompt(model, tokenizer, [10, 11], prefix=" ab") == [1, 10, 11, 2, 3, 5, 32, 97, 98]
+    assert WhisperModel.get_prompt(model, tokenizer, [], prefix=None) == [2, 3]
+
+
+def test_timing_record():
+    class CountingASR(ClockWordsASR):
+        def transcribe_stream(self, audio, stage_timer=None, **kwargs):
+            with stage_timer.stage("decode"):
+                stage_timer.count("windows")
+                stage_timer.count("tokens", 7)
+            return super().transcribe_stream(audio, **kwargs)
+
+    records = []
+    processor = OnlineASRProcessor(CountingASR(), on_iteration=records.append)
+    for i in range(3):
+        processor.insert_audio_chunk(np.arange(i * 16000, (i + 1) * 16000, dtype=np.float32) / 16000)
+        processor.process_iter()
+
+    assert len(records) == 3
+    for i, r in enumerate(records):
+        assert set(r) == {"time", "buffer", "received", "total", "stages", "windows", "tokens", "fallbacks",
+                          "commit_delay"}
+        assert r["time"] == r["buffer"] == i + 1
+        assert r["received"] == 1
+        assert {"features", "decode", "hypothesis"} <= set(r["stages"])
+        assert (r["windows"], r["tokens"], r["fallbacks"]) == (1, 7, 0)
+        assert 0 <= r["stages"]["decode"] <= r["total"]
+    # nothing is commited in the first iteration, then the words of the previous buffer are: w0 w1, then w2 w3
+    assert records[0]["commit_delay"] is None
+    assert records[1]["commit_delay"] == pytest.approx(2 - 0.37)
+    assert records[2]["commit_delay"] == pytest.approx(3 - 1.37)
+
+
+def test_silence_excision():
+    asr = EdgeWordsASR()
+    processor = OnlineASRProcessor(asr, excise_silence=1.0)
+    processor.vad_cache.vad = WindowValueModel()
+    # 64 voiced, 128 silent and 64 voiced VAD windows
+    probs = np.repeat([0.9, 0.1, 0.9], [64, 128, 64])
+    processor.insert_audio_chunk(np.repeat(probs, 512).astype(np.float32))
+    processor.process_iter()
+
+    # the silence is cut out except for the speech padding of 400 ms on both sides
+    silence = (128 * 512 - 2 * 6400) / 16000
+    assert asr.transcribed == 256 * 512 - silence * 16000
+    words = processor.transcript_buffer.buffer
+    assert words[0][:2] == (0.0, 0.5)
+    assert words[1][:2] == pytest.approx((256 * 512 / 16000 - 0.5, 256 * 512 / 16000), abs=0.01)
+
+
+def test_interim():
+    processor = OnlineASRProcessor(EdgeWordsASR())
+    assert processor.interim == (None, None, "")
+    processor.insert_audio_chunk(np.zeros(16000 * 2, dtype=np.float32))
+    assert processor.process_iter() == (None, None, "")
+    assert processor.interim == (0.0, 2.0, " first last")
+    assert processor.finish() == (0.0, 2.0, " first last")
+    assert processor.interim == (None, None, "")
+
+
+def test_vad_gate_keeps_untranscribed_voice():
+    class NoWordsASR(EdgeWordsASR):
+        def transcribe_stream(self, audio, **kwargs):
+            self.transcribed = len(audio)
+            return iter([]), SimpleNamespace(language="en", language_probability=1.0)
+
+    asr = NoWordsASR()
+    processor = OnlineASRProcessor(asr, vad_gate=True, buffer_trimming=("segment", 2))
+    processor.vad_cache.vad = WindowValueModel()
+    processor.insert_audio_chunk(np.full(16000, 0.9, dtype=np.float32))
+    processor.process_iter()
+    for _ in range(4):
+        processor.insert_audio_chunk(np.full(16000, 0.1, dtype=np.float32))
+        processor.process_iter()
+    # the voiced second produced no words, so the silent iterations don't trim it
+    assert processor.skipped_iterations > 0
+    assert processor.buffer_time_offset == 0
+    assert len(processor.audio_buffer) == 5 * 16000
+
+    # the next speech is transcribed together with it
+    processor.insert_audio_chunk(np.full(16000, 0.9, dtype=np.float32))
+    processor.process_iter()
+    assert asr.transcribed == 6 * 16000
+
+
+@pytest.mark.parametrize("vac", [False, True])
+def test_snapshot_restore(jfk_path, vac):
+    audio = decode_audio(jfk_path)
+    chunks = [audio[i : i + 8000] for i in range(0, len(audio), 8000)]
+
+    def processor():
+        if vac:
+            return VACOnlineASRProcessor(0.5, EdgeWordsASR(), vad_gate=True)
+        return OnlineASRProcessor(EdgeWordsASR(), vad_gate=True)
+
+    def stream(online, chunks):
+        out = []
+        for chunk in chunks:
+            online.insert_audio_chunk(chunk)
+            out.append(online.process_iter())
+        return out
+
+    online = processor()
+    online.init()
+    expected = stream(online, chunks) + [online.finish()]
+
+    online = processor()
+    online.init()
+    out = stream(online, chunks[:7])
+    state = online.snapshot()
+    online = processor()
+    online.restore(state)
+    out += stream(online, chunks[7:]) + [online.finish()]
+    assert out == expected
+
+
+def test_pipelined_finish_order():
+    release = threading.Event()
+
+    class BlockingFinalizeProcessor(VACOnlineASRProcessor):
+        def finalize(self, online):
+            release.wait(5)
+            return super().finalize(online)
+
+    processor = BlockingFinalizeProcessor(0.5, EdgeWordsASR(), pipelined_finish=True)
+    processor.vac = FixedVADIterator(WindowValueModel())
+    processor.init()
+
+    def stream(values):
+        out = []
+        for v in values:
+            processor.insert_audio_chunk(np.full(4096, v, dtype=np.float32))
+            out.append(processor.process_iter())
+        return [o for o in out if o[0] is not None]
+
+    # the first utterance ends, and its finalization waits
+    out = stream([0.9] * 8 + [0.1] * 8)
+    assert processor.outputs and not processor.outputs[0].done()
+    # the next utterance is processed, its outputs wait for the final output of the first one
+    assert stream([0.9] * 12) == []
+    assert processor.interim == (None, None, "")
+    assert processor.idle == []
+
+    release.set()
+    processor.outputs[0].result()
+    out += stream([0.9] * 8 + [0.1] * 8) + [processor.finish()]
+    out = [o for o in out if o[0] is not None]
+    assert len(out) >= 2
+    # the outputs are in the order of the stream, the first utterance ends before the second starts
+    assert all(a[1] <= b[0] for a, b in zip(out, out[1:]))
+    assert out[0][1] < 16 * 4096 / 16000
+    # the final output of the first utterance is emitted first, together with the held outputs of the second one
+    assert out[1][0] < 16 * 4096 / 16000 < out[1][1]
+    # the finalized ASR processor is handed back to the caller's thread
+    assert len(processor.idle) == 1
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from faster_whisper.job_queue import JobQueue
+
+
+class FakePipeline:
+    """Returns a segment per second of the audio, and blocks until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append(kwargs)
+        if len(audio) == 0:
+            raise ValueError("empty audio")
+
+        def segments():
+            self.release.wait()
+            for i in range(len(audio) // 16000):
+                yield SimpleNamespace(start=float(i), end=i + 1.0, text=f" s{i}", words=None)
+
+        return segments(), SimpleNamespace(language=kwargs.get("language"))
+
+
+def test_job_queue():
+    pipeline = FakePipeline()
+    jobs = JobQueue(lambda: pipeline, workers=1, max_queue=1, max_jobs=1, language="en", batch_size=4)
+
+    first = jobs.submit(np.zeros(3 * 16000, dtype=np.float32), language="cs")
+    # the worker takes the first job, the second one waits and fills the queue
+    while first.to_dict()["status"] != "running":
+        time.sleep(0.01)
+    second = jobs.submit(np.zeros(0, dtype=np.float32))
+    with pytest.raises(queue.Full):
+        jobs.submit(np.zeros(16000, dtype=np.float32))
+    assert jobs.get(second.id) is second
+
+    pipeline.release.set()
+    assert first.wait(5) and second.wait(5)
+    d = first.to_dict()
+    assert d["status"] == "done" and d["language"] == "cs" and d["duration"] == 3
+    assert [s["text"] for s in d["segments"]] == [" s0", " s1", " s2"]
+    assert [s["text"] for s in first.to_dict(since=2)["segments"]] == [" s2"]
+    assert d["rtf"] == pytest.approx(d["compute"] / 3)
+    assert pipeline.calls[0] == dict(language="cs", batch_size=4)
+
+    d = second.to_dict()
+    assert d["status"] == "failed" and d["error"] == "empty audio" and d["segments"] == []
+    # only the last finished job is kept
+    assert jobs.get(first.id) is None and jobs.get(second.id) is second
+    jobs.stop()
+
+
+class StatefulPipeline:
+    """Keeps the end of the last transcribed segment on itself, as BatchedInferencePipeline.last_speech_timestamp."""
+
+    def __init__(self, barrier):
+        self.barrier = barrier
+        self.last_end = 0.0
+
+    def transcribe(self, audio, **kwargs):
+        self.last_end = 0.0
+
+        def segments():
+            for i in range(3):
+                self.barrier.wait(5)  # the two jobs run at the same time
+                start = self.last_end
+                self.last_end = start + len(audio) / 16000
+                yield SimpleNamespace(start=start, end=self.last_end, text=f" {len(audio)}", words=None)
+
+        return segments(), SimpleNamespace(language="en")
+
+
+def test_job_queue_concurrent_jobs():
+    barrier = threading.Barrier(2)
+    pipelines = []
+
+    def factory():
+        pipelines.append(StatefulPipeline(barrier))
+        return pipelines[-1]
+
+    jobs = JobQueue(factory, workers=2)
+    first = jobs.submit(np.zeros(16000, dtype=np.float32))
+    second = jobs.submit(np.zeros(2 * 16000, dtype=np.float32))
+    assert first.wait(5) and second.wait(5)
+    assert len(pipelines) == 2
+    assert [(s["start"], s["end"]) for s in first.to_dict()["segments"]] == [(0, 1), (1, 2), (2, 3)]
+    assert [(s["start"], s["end"]) for s in second.to_dict()["segments"]] == [(0, 2), (2, 4), (4, 6)]
+    jobs.stop()
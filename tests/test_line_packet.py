@@ -0,0 +1,33 @@
+import numpy as np
+
+from faster_whisper.line_packet import PCM16Decoder, interim_delta
+
+
+def test_pcm16_decoder():
+    samples = np.array([0, 1, -1, 32767, -32768, 1234, -4321], dtype="<i2")
+    raw = samples.tobytes()
+    expected = samples.astype(np.float32) / 32768
+
+    decoder = PCM16Decoder(capacity=4)
+    # packets that split the samples at odd byte boundaries
+    for packet in (raw[:3], raw[3:4], b"", raw[4:9], raw[9:]):
+        decoder.feed(packet)
+    assert len(decoder) == len(samples)
+    first = decoder.take()
+    np.testing.assert_array_equal(first, expected)
+    assert first.dtype == np.float32
+    assert len(decoder) == 0
+
+    decoder.feed(raw[:5])
+    second = decoder.take()
+    decoder.feed(raw[5:] + raw)
+    np.testing.assert_array_equal(second, expected[:2])
+    np.testing.assert_array_equal(decoder.take(), np.concatenate([expected[2:], expected]))
+    # the taken chunks are not modified by the later packets
+    np.testing.assert_array_equal(first, expected)
+
+
+def test_interim_delta():
+    assert interim_delta("", "hello") == (0, "hello")
+    assert interim_delta("hello world", "hello there") == (6, "there")
+    assert interim_delta("hello", "hello") == (5, "")
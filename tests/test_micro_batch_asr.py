@@ -0,0 +1,106 @@
+import dataclasses
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from faster_whisper.transcribe import TranscriptionOptions
+from faster_whisper.WhisperBackend import MicroBatchASR
+
+OPTIONS = TranscriptionOptions(*[None for _ in dataclasses.fields(TranscriptionOptions)])
+
+
+class FakeFeatureExtractor:
+    n_samples = 30 * 16000
+
+    def __call__(self, audio):
+        return np.zeros((80, len(audio) // 160 + 1), dtype=np.float32)
+
+
+class FakeASR:
+    """Transcribes directly to a segment with the text "direct"."""
+
+    def __init__(self, lan="en"):
+        self.model = SimpleNamespace(model=SimpleNamespace(is_multilingual=True),
+                                     feature_extractor=FakeFeatureExtractor())
+        self.original_language = lan
+        self.transcribe_kargs = {}
+        self.direct = []
+
+    def transcribe_stream(self, audio, init_prompt="", **kwargs):
+        self.direct.append(init_prompt)
+        return iter([SimpleNamespace(text="direct")]), SimpleNamespace(language=kwargs.get("language"))
+
+
+class EchoBatchASR(MicroBatchASR):
+    """Returns the prompt of every call as its segment, the prompt "fallback" needs the temperature fallback."""
+
+    def __init__(self, *args, **kwargs):
+        self.groups = []
+        super().__init__(*args, **kwargs)
+
+    def process_batch(self, language, decoding, requests):
+        self.groups.append([(r["key"], r["prompt"]) for r in requests])
+        return [None if r["prompt"] == "fallback" else ([SimpleNamespace(text=r["prompt"])], 1, OPTIONS)
+                for r in requests]
+
+
+def test_micro_batch_scheduler():
+    asr = FakeASR()
+    mb = EchoBatchASR(asr, window=0.5, max_batch=3)
+    results = {}
+
+    def session(i):
+        options = dict(beam_size=1) if i == 4 else {}
+        segments, info = mb.transcribe_stream(np.zeros(16000, dtype=np.float32), init_prompt=f"p{i}", **options)
+        results[i] = ([s.text for s in segments], info.language, info.transcription_options.initial_prompt)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # every caller gets its own result
+    assert results == {i: ([f"p{i}"], "en", f"p{i}") for i in range(5)}
+    assert sum(len(g) for g in mb.groups) == 5
+    assert max(len(g) for g in mb.groups) > 1
+    for group in mb.groups:
+        assert len(group) <= 3
+        assert len({key for key, _ in group}) == 1  # only the calls with the same options are batched
+    keys = {prompt: key for group in mb.groups for key, prompt in group}
+    assert keys["p0"] == keys["p3"] != keys["p4"]
+    assert mb.batched_calls == 5 and asr.direct == []
+
+    # the calls that can't be batched, and the calls that need the temperature fallback, are transcribed directly
+    n = len(mb.groups)
+    assert [s.text for s in mb.transcribe(np.zeros(31 * 16000, dtype=np.float32), init_prompt="long")] == ["direct"]
+    assert [s.text for s in mb.transcribe(np.zeros(16000, dtype=np.float32), init_prompt="vad",
+                                          vad_filter=True)] == ["direct"]
+    assert [s.text for s in mb.transcribe(np.zeros(16000, dtype=np.float32), init_prompt="fallback")] == ["direct"]
+    assert asr.direct == ["long", "vad", "fallback"]
+    assert len(mb.groups) == n + 1
+    mb.stop()
+
+    asr = FakeASR(lan=None)
+    mb = EchoBatchASR(asr, window=0.01)
+    assert [s.text for s in mb.transcribe(np.zeros(16000, dtype=np.float32), init_prompt="detect")] == ["direct"]
+    assert [s.text for s in mb.transcribe(np.zeros(16000, dtype=np.float32), init_prompt="cs",
+                                          language="cs")] == ["cs"]
+    assert mb.groups[0][0][0][0] == "cs"
+    mb.stop()
+
+
+def test_micro_batch_thresholds():
+    decoding = {o: MicroBatchASR.defaults()[o] for o in MicroBatchASR.BATCHED_OPTIONS}
+    assert not MicroBatchASR.needs_fallback(decoding, 1.5, -0.5, 0.1)
+    assert MicroBatchASR.needs_fallback(decoding, 3.0, -0.5, 0.1)
+    assert MicroBatchASR.needs_fallback(decoding, 1.5, -1.5, 0.1)
+    assert not MicroBatchASR.needs_fallback(decoding, 1.5, -1.5, 0.9)  # silence
+    assert not MicroBatchASR.needs_fallback(dict(decoding, temperature=[0.0]), 3.0, -1.5, 0.1)
+    assert not MicroBatchASR.needs_fallback(dict(decoding, log_prob_threshold=None), 1.5, -1.5, 0.1)
+
+    assert MicroBatchASR.no_speech(decoding, -1.5, 0.9)
+    assert not MicroBatchASR.no_speech(decoding, -0.5, 0.9)
+    assert not MicroBatchASR.no_speech(decoding, -1.5, 0.5)
+    assert not MicroBatchASR.no_speech(dict(decoding, no_speech_threshold=0.95), -1.5, 0.9)
+    assert MicroBatchASR.no_speech(dict(decoding, log_prob_threshold=None), -0.5, 0.9)